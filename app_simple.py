@@ -6,15 +6,31 @@ import yfinance as yf
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
-from sklearn.linear_model import LinearRegression
 from datetime import datetime, timedelta
 import plotly.graph_objects as go
 import plotly.express as px
 from plotly.subplots import make_subplots
 import requests
+from requests.adapters import HTTPAdapter
+import io
 import json
+import math
+import copy
+import contextlib
+from collections import OrderedDict
+import re
 import time
+import random
 import finnhub
+import threading
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait as wait_futures, FIRST_COMPLETED
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+try:
+    import numba
+except ImportError:
+    numba = None
 
 # 設置頁面配置
 st.set_page_config(
@@ -187,13 +203,17 @@ with st.sidebar:
             "混合模式 (推薦)", 
             "Finnhub API (即時)",
             "Alpha Vantage API (實時)", 
-            "Yahoo Finance (15分鐘延遲)"
+            "Yahoo Finance (15分鐘延遲)",
+            "本地回放 (離線)"
         ],
         index=0,
         key="data_source_select",
         help="選擇股票數據的來源"
     )
     
+    # 回放模式只使用本地錄製的數據，不連接網絡
+    replay_mode = data_source == "本地回放 (離線)"
+    
     # 添加時間週期選擇器，修改样式確保能正確顯示所有選項
     period = st.selectbox(
         "時間週期",
@@ -238,9 +258,43 @@ with st.sidebar:
     show_volume = st.checkbox("顯示交易量", value=True)
     show_ma = st.checkbox("顯示移動平均線", value=True)
     show_rsi = st.checkbox("顯示RSI指標", value=True)
+    show_backtest = st.checkbox("歷史訊號回測", value=False,
+                                help="以分析期間內的每個交易日回測 RSI、均線交叉和整體建議訊號")
+    run_sweep = st.checkbox("RSI參數掃描", value=False,
+                            help="以向量化運算一次回測所有股票在不同RSI週期與超買超賣閾值組合下的表現，並按策略收益排名")
+    
+    # 蒙地卡羅預測區間
+    show_mc = st.checkbox("蒙地卡羅預測區間", value=False,
+                          help="以歷史日收益重抽樣模擬價格路徑，在預測價格周圍顯示 5%-95% 區間")
+    mc_paths = st.number_input("模擬路徑數", min_value=1000, max_value=100000, value=10000, step=1000,
+                               disabled=not show_mc)
     
     # 設置移動平均線週期
     ma_periods = [20, 50, 200] if show_ma else []
+    
+    # 效能設置
+    st.markdown("""
+    <div style="margin: 20px 0 10px 0; padding-top: 10px; border-top: 1px solid #eee;">
+        <h3 style="font-size: 1rem; color: #424242; margin: 0 0 10px 0;">效能設置</h3>
+    </div>
+    """, unsafe_allow_html=True)
+    
+    # 多股票比對時的並行分析數，設為1即逐一分析
+    max_workers = st.number_input("並行分析數", min_value=1, max_value=16, value=8,
+                                  help="多股票比對時同時分析的股票數量，設為1則逐一分析")
+    
+    # 混合模式下同時向多個數據源請求，取最先返回的有效數據
+    hedged_mode = st.checkbox("混合模式競速請求", value=True,
+                              help="Yahoo Finance 未在延遲內返回時同時向 Alpha Vantage 請求，採用最先返回的數據")
+    hedge_delay = st.number_input("備援請求延遲 (秒)", min_value=0.0, max_value=10.0, value=1.5, step=0.5,
+                                  disabled=not hedged_mode)
+    
+    # 錄製分析使用的數據，供離線回放與效能測試使用
+    record_mode = st.checkbox("錄製分析數據", value=False, disabled=replay_mode,
+                              help="將每支股票最終用於分析的數據（不論來自哪個數據源或快取）保存為本地數據，供「本地回放」使用")
+    replay_latency_ms = st.number_input("回放延遲 (毫秒)", min_value=0, max_value=5000, value=0, step=50,
+                                        disabled=not replay_mode,
+                                        help="回放時為每個請求加入的模擬網絡延遲")
 
 # 添加標準美股清單用於股票搜索建議
 @st.cache_data(ttl=86400)
@@ -298,60 +352,1152 @@ def get_us_stock_list():
 # 添加布林帶計算函數
 def calculate_bollinger_bands(df, window=20, num_std=2):
     """Calculate Bollinger Bands for the given dataframe"""
-    df = df.copy()
-    df['MA'] = df['Close'].rolling(window=window).mean()
-    df['BB_upper'] = df['MA'] + (df['Close'].rolling(window=window).std() * num_std)
-    df['BB_lower'] = df['MA'] - (df['Close'].rolling(window=window).std() * num_std)
-    return df
+    indicators = compute_indicators(df, [("MA", window), ("BB", window, num_std)])
+    return pd.concat([df, indicators.rename(columns={f'MA_{window}': 'MA'})], axis=1)
 
 # 添加MACD計算函數
 def calculate_macd(df, fast=12, slow=26, signal=9):
     """計算MACD指標"""
-    df = df.copy()
-    df['EMA_fast'] = df['Close'].ewm(span=fast, adjust=False).mean()
-    df['EMA_slow'] = df['Close'].ewm(span=slow, adjust=False).mean()
-    df['MACD'] = df['EMA_fast'] - df['EMA_slow']
-    df['Signal_Line'] = df['MACD'].ewm(span=signal, adjust=False).mean()
-    df['MACD_Histogram'] = df['MACD'] - df['Signal_Line']
+    indicators = compute_indicators(df, [("EMA", fast), ("EMA", slow), ("MACD", fast, slow, signal)])
+    indicators = indicators.rename(columns={f'EMA_{fast}': 'EMA_fast', f'EMA_{slow}': 'EMA_slow'})
+    return pd.concat([df, indicators], axis=1)
+
+# 多股票面板：將所有股票的收盤價對齊為 日期 × 股票 的二維數組
+def build_close_panel(frames):
+    """frames 為 {代碼: DataFrame}，按所有股票日期的聯集對齊，缺少的日期為 NaN"""
+    symbols = list(frames)
+    if not symbols:
+        return pd.DataFrame(dtype=np.float64)
+    closes = pd.concat([frames[symbol]['Close'] for symbol in symbols], axis=1, keys=symbols, sort=True)
+    return closes.astype(np.float64)
+
+# 將每欄的有效值按原順序移到頂部，使每支股票按自己的交易日計算
+def compact_columns(values):
+    """返回 (壓縮後的數組, 每個壓縮位置對應的原行號)；各欄有效值之後補 NaN"""
+    order = np.argsort(np.isnan(values), axis=0, kind='stable')
+    return np.take_along_axis(values, order, axis=0), order
+
+# compact_columns 的逆操作，原本缺失的位置設為 NaN
+def expand_columns(compact, order, valid):
+    out = np.empty(compact.shape)
+    np.put_along_axis(out, order, compact, axis=0)
+    return np.where(valid, out, np.nan)
+
+# 方差相對於窗口平方和過小時，視為出現相消誤差，改用逐窗口重新計算
+ROLLING_CANCELLATION_TOL = 1e-8
+
+# 多窗口滾動統計核心：一次累加同時得到所有窗口的平均與標準差
+def rolling_stats_2d(values, windows, std_windows=()):
+    """沿時間軸（第0軸）計算每一欄的滾動平均與樣本標準差（ddof=1），返回 ({窗口: 平均}, {窗口: 標準差})
+    
+    和、平方和與有效計數各只累加一次，所有窗口共用同一組前綴和；窗口內有 NaN 時結果為 NaN（與 pandas 的 rolling 一致）。
+    累加前先減去每一欄的平均值，方差出現明顯相消時再對受影響的位置逐窗口重新計算。
+    """
+    valid = ~np.isnan(values)
+    filled = np.where(valid, values, 0.0)
+    valid_counts = valid.sum(axis=0)
+    center = np.divide(filled.sum(axis=0), valid_counts, out=np.zeros(values.shape[1]), where=valid_counts > 0)
+    centered = np.where(valid, filled - center, 0.0)
+    
+    zeros = np.zeros((1, values.shape[1]))
+    sums = np.concatenate([zeros, np.cumsum(centered, axis=0)])
+    counts = np.concatenate([zeros, np.cumsum(valid, axis=0)])
+    squares = np.concatenate([zeros, np.cumsum(centered ** 2, axis=0)]) if std_windows else None
+    
+    means, stds = {}, {}
+    for window in set(windows) | set(std_windows):
+        mean = np.full(values.shape, np.nan)
+        std = np.full(values.shape, np.nan)
+        if window <= len(values):
+            full = (counts[window:] - counts[:-window]) == window
+            window_sums = sums[window:] - sums[:-window]
+            mean[window - 1:] = np.where(full, window_sums / window + center, np.nan)
+            if window in std_windows and window > 1:
+                window_squares = squares[window:] - squares[:-window]
+                deviation = np.maximum(window_squares - window_sums ** 2 / window, 0.0)
+                std[window - 1:] = np.where(full, np.sqrt(deviation / (window - 1)), np.nan)
+                unstable = full & (deviation < ROLLING_CANCELLATION_TOL * window_squares)
+                if unstable.any():
+                    rows, cols = np.nonzero(unstable)
+                    rows = rows + window - 1
+                    samples = values[rows[:, None] - np.arange(window)[::-1], cols[:, None]]
+                    std[rows, cols] = samples.std(axis=1, ddof=1)
+        means[window] = mean
+        stds[window] = std
+    return {w: means[w] for w in windows}, {w: stds[w] for w in std_windows}
+
+# 二維數組的滾動平均
+def rolling_mean_2d(values, window):
+    """單一窗口的滾動平均，與 rolling_stats_2d 共用同一核心"""
+    return rolling_stats_2d(values, [window])[0][window]
+
+# 遞推指標的計算後端：安裝了 Numba 時預設使用編譯核心（可設 STOCK_INDICATOR_BACKEND=numpy 停用）
+INDICATOR_BACKEND = os.environ.get("STOCK_INDICATOR_BACKEND", "numba" if numba is not None else "numpy")
+
+# EMA 遞推核心（可由 Numba 編譯），語義與 ema_2d 的 NumPy 版本相同
+def ema_loop(values, alpha):
+    rows, cols = values.shape
+    out = np.empty((rows, cols))
+    for j in range(cols):
+        prev = np.nan
+        for t in range(rows):
+            x = values[t, j]
+            if not np.isnan(x):
+                prev = x if np.isnan(prev) else alpha * x + (1 - alpha) * prev
+            out[t, j] = prev
+    return out
+
+# Wilder RSI 遞推核心（可由 Numba 編譯）：首個窗口以簡單平均為種子，之後以 1/window 平滑
+def wilder_rsi_loop(close, window):
+    n = len(close)
+    out = np.full(n, np.nan)
+    if n <= window:
+        return out
+    avg_gain = 0.0
+    avg_loss = 0.0
+    for t in range(n):
+        if t > 0:
+            delta = close[t] - close[t - 1]
+            gain = delta if delta > 0 else 0.0
+            loss = -delta if delta < 0 else 0.0
+            if t <= window:
+                avg_gain += gain / window
+                avg_loss += loss / window
+            else:
+                avg_gain = (avg_gain * (window - 1) + gain) / window
+                avg_loss = (avg_loss * (window - 1) + loss) / window
+        if t >= window:
+            if avg_loss > 0:
+                out[t] = 100 - 100 / (1 + avg_gain / avg_loss)
+            elif avg_gain > 0:
+                out[t] = 100.0
+    return out
+
+# 編譯後的核心在所有執行間共用，只在第一次使用時編譯
+@st.cache_resource
+def get_jit_kernels():
+    """未安裝 Numba 或選擇 numpy 後端時返回 None，調用方改用 NumPy/pandas 實現"""
+    if INDICATOR_BACKEND != "numba" or numba is None:
+        return None
+    jit = numba.njit(cache=True, error_model='numpy')
+    return {"ema": jit(ema_loop), "wilder_rsi": jit(wilder_rsi_loop)}
+
+# Wilder 平滑的 RSI 數組
+def wilder_rsi_values(close, window=14):
+    """close 為一維收盤價數組；未使用編譯核心時以 pandas 的 ewm 計算同樣的遞推
+    
+    缺失值在兩種後端之前先移除：只在有效的收盤價上遞推，缺失的位置為 NaN。
+    """
+    close = np.ascontiguousarray(close, dtype=np.float64)
+    valid = ~np.isnan(close)
+    if not valid.all():
+        out = np.full(len(close), np.nan)
+        out[valid] = wilder_rsi_values(close[valid], window)
+        return out
+    kernels = get_jit_kernels()
+    if kernels is not None:
+        return kernels["wilder_rsi"](close, window)
+    out = np.full(len(close), np.nan)
+    if len(close) <= window:
+        return out
+    delta = pd.Series(np.diff(close))
+    # 以首個窗口的簡單平均替換第一個值後，adjust=False 的 ewm 即為 Wilder 平滑
+    gains = delta.clip(lower=0).iloc[window - 1:].copy()
+    losses = (-delta).clip(lower=0).iloc[window - 1:].copy()
+    gains.iloc[0] = delta.clip(lower=0).iloc[:window].mean()
+    losses.iloc[0] = (-delta).clip(lower=0).iloc[:window].mean()
+    avg_gain = gains.ewm(alpha=1 / window, adjust=False).mean().to_numpy()
+    avg_loss = losses.ewm(alpha=1 / window, adjust=False).mean().to_numpy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        out[window:] = 100 - 100 / (1 + avg_gain / avg_loss)
+    return out
+
+# 二維數組的指數移動平均（adjust=False）
+def ema_2d(values, span):
+    """沿時間軸遞推，每一步同時更新所有股票；每欄從第一個有效值開始，缺失值沿用前值"""
+    alpha = 2.0 / (span + 1)
+    kernels = get_jit_kernels()
+    if kernels is not None:
+        return kernels["ema"](np.ascontiguousarray(values, dtype=np.float64), alpha)
+    out = np.full(values.shape, np.nan)
+    prev = np.full(values.shape[1], np.nan)
+    for t in range(len(values)):
+        x = values[t]
+        updated = np.where(np.isnan(prev), x, alpha * x + (1 - alpha) * prev)
+        prev = np.where(np.isnan(x), prev, updated)
+        out[t] = prev
+    return out
+
+# 以面板方式一次計算所有股票的技術指標
+def compute_panel_indicators(closes, rsi_window=14, ma_periods=(20, 50, 200), bb_window=20, bb_std=2, macd_params=(12, 26, 9)):
+    """closes 為 build_close_panel 的結果，返回 {指標名稱: 日期 × 股票 的 DataFrame}
+    
+    指標名稱與單一股票函數的欄位一致：RSI、MA_{週期}、BB_upper/BB_lower、MACD/Signal_Line/MACD_Histogram。
+    傳入 None 或空序列可跳過對應的指標。
+    每支股票只在自己的交易日上計算（其他股票的日期不會打斷窗口），結果與單一股票函數相同；該股票沒有數據的日期為 NaN。
+    """
+    valid = ~np.isnan(closes.to_numpy(dtype=np.float64))
+    values, order = compact_columns(closes.to_numpy(dtype=np.float64))
+    results = {}
+    
+    def to_frame(array):
+        return pd.DataFrame(expand_columns(array, order, valid), index=closes.index, columns=closes.columns)
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if rsi_window:
+            delta = np.full(values.shape, np.nan)
+            delta[1:] = values[1:] - values[:-1]
+            avg_gain = rolling_mean_2d(np.where(np.isnan(delta), np.nan, np.maximum(delta, 0.0)), rsi_window)
+            avg_loss = rolling_mean_2d(np.where(np.isnan(delta), np.nan, np.maximum(-delta, 0.0)), rsi_window)
+            results['RSI'] = to_frame(100 - 100 / (1 + avg_gain / avg_loss))
+        
+        # 均線與布林帶共用一次滾動統計
+        mean_windows = list(ma_periods or ()) + ([bb_window] if bb_window else [])
+        std_windows = [bb_window] if bb_window else []
+        means, stds = rolling_stats_2d(values, mean_windows, std_windows) if mean_windows else ({}, {})
+        
+        for period in ma_periods or ():
+            results[f'MA_{period}'] = to_frame(means[period])
+        
+        if bb_window:
+            band = stds[bb_window] * bb_std
+            results['BB_upper'] = to_frame(means[bb_window] + band)
+            results['BB_lower'] = to_frame(means[bb_window] - band)
+        
+        if macd_params:
+            fast, slow, signal = macd_params
+            macd = ema_2d(values, fast) - ema_2d(values, slow)
+            signal_line = ema_2d(macd, signal)
+            results['MACD'] = to_frame(macd)
+            results['Signal_Line'] = to_frame(signal_line)
+            results['MACD_Histogram'] = to_frame(macd - signal_line)
+    
+    return results
+
+# 增量指標的預設參數
+STREAM_PARAMS = {"rsi_window": 14, "ma_periods": [20, 50, 200], "bb_window": 20, "bb_std": 2, "macd": [12, 26, 9]}
+
+# 增量指數移動平均的狀態（adjust=False，以第一個值為起點）
+def new_ema_state(span):
+    return {"alpha": 2.0 / (span + 1), "value": None}
+
+def update_ema_state(state, x):
+    state["value"] = x if state["value"] is None else state["alpha"] * x + (1 - state["alpha"]) * state["value"]
+    return state["value"]
+
+# 增量滾動窗口的狀態，以環形緩衝保存窗口內的數值
+def new_window_state(window):
+    return {"window": window, "buffer": [0.0] * window, "pos": 0, "count": 0, "mean": 0.0, "m2": 0.0}
+
+def update_window_state(state, x):
+    """加入新值並移除窗口外的舊值，以 Welford 公式更新平均值與平方差和"""
+    window = state["window"]
+    if state["count"] < window:
+        state["count"] += 1
+        delta = x - state["mean"]
+        state["mean"] += delta / state["count"]
+        state["m2"] += delta * (x - state["mean"])
+    else:
+        old = state["buffer"][state["pos"]]
+        old_mean = state["mean"]
+        state["mean"] = old_mean + (x - old) / window
+        state["m2"] = max(0.0, state["m2"] + (x - old) * (x - state["mean"] + old - old_mean))
+    state["buffer"][state["pos"]] = x
+    state["pos"] = (state["pos"] + 1) % window
+
+def window_mean(state):
+    """窗口未滿時返回 None（與 rolling 的 NaN 對應）"""
+    return state["mean"] if state["count"] == state["window"] else None
+
+def window_std(state):
+    """樣本標準差（ddof=1），窗口未滿時返回 None"""
+    if state["count"] < state["window"] or state["window"] < 2:
+        return None
+    return math.sqrt(state["m2"] / (state["window"] - 1))
+
+# 建立所有增量指標的狀態
+def new_stream_state(params=STREAM_PARAMS):
+    """狀態只包含基本類型，可直接以 JSON 保存"""
+    fast, slow, signal = params["macd"]
+    return {
+        "params": params,
+        "last_date": None,
+        "prev_close": None,
+        "gain": new_window_state(params["rsi_window"]),
+        "loss": new_window_state(params["rsi_window"]),
+        "ma": {str(period): new_window_state(period) for period in params["ma_periods"]},
+        "bb": new_window_state(params["bb_window"]),
+        "ema_fast": new_ema_state(fast),
+        "ema_slow": new_ema_state(slow),
+        "ema_signal": new_ema_state(signal),
+    }
+
+# 加入一根新K線
+def update_stream_state(state, close, date=None):
+    """更新所有指標並返回最新值，計算量與歷史長度無關"""
+    if state["prev_close"] is not None:
+        delta = close - state["prev_close"]
+        update_window_state(state["gain"], max(delta, 0.0))
+        update_window_state(state["loss"], max(-delta, 0.0))
+    state["prev_close"] = close
+    for ma_state in state["ma"].values():
+        update_window_state(ma_state, close)
+    update_window_state(state["bb"], close)
+    macd = update_ema_state(state["ema_fast"], close) - update_ema_state(state["ema_slow"], close)
+    update_ema_state(state["ema_signal"], macd)
+    if date is not None:
+        state["last_date"] = date
+    return stream_state_values(state)
+
+# 讀取增量指標的最新值
+def stream_state_values(state):
+    """返回與單一股票函數欄位名稱一致的指標值，數據不足時為 None；Date 為最後加入的K線日期"""
+    values = {"Date": state["last_date"]}
+    
+    avg_gain, avg_loss = window_mean(state["gain"]), window_mean(state["loss"])
+    if avg_gain is None or avg_loss is None or (avg_gain == 0 and avg_loss == 0):
+        values["RSI"] = None
+    elif avg_loss == 0:
+        values["RSI"] = 100.0
+    else:
+        values["RSI"] = 100 - 100 / (1 + avg_gain / avg_loss)
+    
+    for period, ma_state in state["ma"].items():
+        values[f"MA_{period}"] = window_mean(ma_state)
+    
+    mid, std = window_mean(state["bb"]), window_std(state["bb"])
+    values["BB_upper"] = mid + std * state["params"]["bb_std"] if std is not None else None
+    values["BB_lower"] = mid - std * state["params"]["bb_std"] if std is not None else None
+    
+    macd = None
+    if state["ema_fast"]["value"] is not None:
+        macd = state["ema_fast"]["value"] - state["ema_slow"]["value"]
+    values["MACD"] = macd
+    values["Signal_Line"] = state["ema_signal"]["value"]
+    values["MACD_Histogram"] = macd - state["ema_signal"]["value"] if macd is not None else None
+    return values
+
+# 以歷史數據建立增量指標狀態
+def build_stream_state(df, params=STREAM_PARAMS):
+    state = new_stream_state(params)
+    for date, close in zip(df.index, df['Close']):
+        update_stream_state(state, float(close), date.strftime("%Y-%m-%d"))
+    return state
+
+# 取每支股票最後一個交易日的指標值
+def latest_panel_values(indicator, closes):
+    """各股票的最後交易日可能不同，按每欄最後一個有效收盤價的位置取值"""
+    valid = ~np.isnan(closes.to_numpy())
+    last_rows = len(valid) - 1 - np.argmax(valid[::-1], axis=0)
+    return pd.Series(indicator.to_numpy()[last_rows, np.arange(valid.shape[1])], index=closes.columns)
+
+# 沿時間軸向前填充每欄最後一個非零值（訊號轉為持倉）
+def forward_fill_signals(signals):
+    rows = np.arange(len(signals))[:, None]
+    last = np.maximum.accumulate(np.where(signals != 0, rows, 0), axis=0)
+    filled = signals[last, np.arange(signals.shape[1])]
+    # 第一個訊號出現前沒有持倉
+    first = np.maximum.accumulate(signals != 0, axis=0)
+    return np.where(first, filled, 0)
+
+# 面板上每個交易日的預測變動（%），與分析結果使用同一個預測模型（expanding_forecast）
+def expanding_forecast_change(values, days=5, min_points=5):
+    """第 t 日僅使用該股票截至 t 日的數據，返回 days 日後的預測價格相對當日收盤價的變動"""
+    valid = ~np.isnan(values)
+    n = np.cumsum(valid, axis=0)
+    forecast = expanding_forecast(values, days)[:, :, -1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        change = (forecast - values) / values * 100
+    return np.where(valid & (n >= min_points), change, np.nan)
+
+# 收盤後 horizon 日的收益與每日收益
+def period_returns(values, horizon):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        forward = np.full(values.shape, np.nan)
+        forward[:-horizon] = values[horizon:] / values[:-horizon] - 1
+        daily = np.zeros(values.shape)
+        daily[1:] = np.nan_to_num(values[1:] / values[:-1] - 1)
+    return forward, daily
+
+# 訊號表現：每列一個訊號序列，forward 與 daily 可按列廣播
+def signal_performance(signal, forward, daily):
+    """返回各列的訊號次數、命中率、平均收益、策略收益和最大回撤（比例）"""
+    events = (signal != 0) & ~np.isnan(forward)
+    signed = np.where(events, signal * forward, 0.0)
+    counts = events.sum(axis=0)
+    hits = (signed > 0).sum(axis=0)
+    
+    # 前一日收盤後的持倉決定當日收益
+    position = np.vstack([np.zeros((1, signal.shape[1])), (forward_fill_signals(signal) == 1)[:-1]])
+    equity = np.cumprod(1 + position * daily, axis=0)
+    drawdown = (equity / np.maximum.accumulate(equity, axis=0) - 1).min(axis=0)
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return {
+            "counts": counts,
+            "hit_rate": hits / counts,
+            "mean_return": signed.sum(axis=0) / counts,
+            "total_return": equity[-1] - 1,
+            "drawdown": drawdown,
+        }
+
+# 向量化回測：RSI 閾值、均線交叉及整體建議訊號
+def backtest_signals(closes, rsi_window=14, oversold=30, overbought=70, horizon=5, prediction_threshold=3):
+    """closes 為 build_close_panel 的結果，所有股票、所有交易日以數組運算一次完成
+    
+    訊號在當日收盤產生：命中率與平均收益以其後 horizon 日的收益衡量（賣出訊號取反向收益）；
+    策略收益為買入訊號後持有、賣出訊號後空倉的淨值曲線，最大回撤取自同一曲線。
+    各股票的交易日曆可能不同，先將每欄壓縮為該股票自己的交易日，收益與指標都按這些交易日計算。
+    """
+    compact, _ = compact_columns(closes.to_numpy(dtype=np.float64))
+    closes = pd.DataFrame(compact, columns=closes.columns)
+    values = compact
+    indicators = compute_panel_indicators(closes, rsi_window=rsi_window, ma_periods=(20, 50), bb_window=None, macd_params=None)
+    rsi = indicators['RSI'].to_numpy()
+    ma_fast = indicators['MA_20'].to_numpy()
+    ma_slow = indicators['MA_50'].to_numpy()
+    
+    # 各類訊號：1 為買入，-1 為賣出，0 為觀望
+    rsi_signal = np.where(rsi < oversold, 1, np.where(rsi > overbought, -1, 0))
+    above = ma_fast > ma_slow
+    crossable = ~np.isnan(ma_slow)
+    crossable[1:] &= crossable[:-1]
+    crossable[0] = False
+    above_prev = np.vstack([above[:1], above[:-1]])
+    cross_signal = np.where(crossable & above & ~above_prev, 1, np.where(crossable & ~above & above_prev, -1, 0))
+    change = expanding_forecast_change(values, days=horizon)
+    prediction_signal = np.where(change > prediction_threshold, 1, np.where(change < -prediction_threshold, -1, 0))
+    # 與分析結果的整體建議相同：任一方法買入即買入，否則任一方法賣出即賣出
+    combined_signal = np.where((rsi_signal == 1) | (prediction_signal == 1), 1,
+                               np.where((rsi_signal == -1) | (prediction_signal == -1), -1, 0))
+    
+    forward, daily = period_returns(values, horizon)
+    buy_hold = np.nanprod(1 + daily, axis=0) - 1
+    
+    rows = []
+    for name, signal in (("RSI", rsi_signal), ("均線交叉", cross_signal), ("整體建議", combined_signal)):
+        performance = signal_performance(signal, forward, daily)
+        for j, symbol in enumerate(closes.columns):
+            rows.append({
+                "代碼": symbol,
+                "策略": name,
+                "訊號次數": int(performance["counts"][j]),
+                "命中率": performance["hit_rate"][j] * 100,
+                "平均收益(%)": performance["mean_return"][j] * 100,
+                "策略收益(%)": performance["total_return"][j] * 100,
+                "最大回撤(%)": performance["drawdown"][j] * 100,
+                "買入持有(%)": buy_hold[j] * 100,
+            })
+    return pd.DataFrame(rows)
+
+# RSI 參數掃描的網格
+SWEEP_RSI_WINDOWS = (7, 9, 14, 21, 28)
+SWEEP_OVERSOLD = (20, 25, 30, 35)
+SWEEP_OVERBOUGHT = (65, 70, 75, 80)
+
+# RSI 參數掃描：所有股票與所有閾值組合在同一個面板上一次評估
+def sweep_rsi_parameters(closes, windows, oversold_levels, overbought_levels, horizon=5):
+    """closes 為 build_close_panel 的結果，每欄先壓縮為該股票自己的交易日
+    
+    每個週期只計算一次面板 RSI，再把 (閾值組合 × 股票) 排成列，以一次 signal_performance 評估；
+    返回 {代碼: [(週期, 超賣, 超買, 表現), ...]}。
+    """
+    compact, _ = compact_columns(closes.to_numpy(dtype=np.float64))
+    panel = pd.DataFrame(compact, columns=closes.columns)
+    forward, daily = period_returns(compact, horizon)
+    pairs = [(low, high) for low in oversold_levels for high in overbought_levels]
+    # 第 k 個閾值組合佔據第 k 組 len(closes.columns) 個列
+    lows = np.repeat(np.array([pair[0] for pair in pairs], dtype=np.float64), panel.shape[1])
+    highs = np.repeat(np.array([pair[1] for pair in pairs], dtype=np.float64), panel.shape[1])
+    forward = np.tile(forward, (1, len(pairs)))
+    daily = np.tile(daily, (1, len(pairs)))
+    
+    sweeps = {symbol: [] for symbol in closes.columns}
+    for window in windows:
+        rsi = compute_panel_indicators(panel, rsi_window=window, ma_periods=(), bb_window=None, macd_params=None)['RSI'].to_numpy()
+        rsi = np.tile(rsi, (1, len(pairs)))
+        signal = np.where(rsi < lows, 1, np.where(rsi > highs, -1, 0))
+        performance = signal_performance(signal, forward, daily)
+        for k, (low, high) in enumerate(pairs):
+            for j, symbol in enumerate(closes.columns):
+                column = k * panel.shape[1] + j
+                sweeps[symbol].append((window, low, high, {name: float(value[column]) for name, value in performance.items()}))
+    return sweeps
+
+# 對多個股票進行參數掃描，返回按策略收益排名的參數組合
+def run_parameter_sweep(frames, windows=SWEEP_RSI_WINDOWS, oversold_levels=SWEEP_OVERSOLD,
+                        overbought_levels=SWEEP_OVERBOUGHT, horizon=5):
+    """在當前進程以數組運算完成，不需要進程池"""
+    if not frames:
+        return pd.DataFrame()
+    sweeps = sweep_rsi_parameters(build_close_panel(frames), windows, oversold_levels, overbought_levels, horizon)
+    
+    rows = [
+        {"RSI週期": window, "超賣閾值": low, "超買閾值": high, "代碼": symbol,
+         "訊號次數": performance["counts"], "命中率": performance["hit_rate"] * 100,
+         "平均收益(%)": performance["mean_return"] * 100, "策略收益(%)": performance["total_return"] * 100,
+         "最大回撤(%)": performance["drawdown"] * 100}
+        for symbol, results in sweeps.items()
+        for window, low, high, performance in results
+    ]
+    if not rows:
+        return pd.DataFrame()
+    ranked = pd.DataFrame(rows).groupby(["RSI週期", "超賣閾值", "超買閾值"], as_index=False).agg(
+        股票數=("代碼", "nunique"),
+        訊號次數=("訊號次數", "sum"),
+        命中率=("命中率", "mean"),
+        平均收益=("平均收益(%)", "mean"),
+        策略收益=("策略收益(%)", "mean"),
+        最大回撤=("最大回撤(%)", "mean"),
+    )
+    ranked = ranked.rename(columns={"平均收益": "平均收益(%)", "策略收益": "策略收益(%)", "最大回撤": "最大回撤(%)"})
+    ranked["訊號次數"] = ranked["訊號次數"].astype(int)
+    ranked = ranked.sort_values(["策略收益(%)", "命中率"], ascending=False, ignore_index=True)
+    ranked.insert(0, "排名", np.arange(1, len(ranked) + 1))
+    return ranked
+
+# 錄製數據的保存目錄
+FIXTURE_DIR = os.environ.get("STOCK_FIXTURE_DIR", "/tmp/stock_fixtures")
+
+# 進程內共享的錄製數據寫入鎖
+@st.cache_resource
+def get_fixture_lock():
+    return threading.Lock()
+
+# 錄製數據的文件路徑
+def get_fixture_path(symbol):
+    """每支股票一個 Parquet 文件（只含數據，讀取時不會執行任何代碼，可安全複製到其他機器回放）"""
+    safe_symbol = re.sub(r"[^A-Za-z0-9_.-]+", "_", symbol)
+    return os.path.join(FIXTURE_DIR, f"{safe_symbol}.parquet")
+
+# 讀取錄製數據，不存在時返回 None
+def load_fixture(symbol):
+    """返回錄製的統一格式數據；回放時加入模擬延遲"""
+    path = get_fixture_path(symbol)
+    if replay_latency_ms:
+        time.sleep(replay_latency_ms / 1000)
+    if not os.path.exists(path):
+        return None
+    return pd.read_parquet(path)
+
+# 保存錄製數據，與已錄製的內容合併
+def record_fixture(symbol, df):
+    """df 為 get_stock_data 最終返回的統一格式數據；同一股票的多次錄製按日期合併，新數據覆蓋舊數據"""
+    path = get_fixture_path(symbol)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    
+    with get_fixture_lock():
+        if os.path.exists(path):
+            existing = pd.read_parquet(path)
+            df = pd.concat([existing[~existing.index.isin(df.index)], df]).sort_index()
+        tmp_path = f"{path}.tmp"
+        df.to_parquet(tmp_path)
+        os.replace(tmp_path, path)
+
+# 回放錄製的數據
+def replay_stock_data(symbol, period_str="6mo"):
+    """時間範圍以錄製數據的最後日期為終點，同一份錄製數據在任何日期回放的結果都相同"""
+    df = load_fixture(symbol)
+    if df is None or df.empty:
+        return None
+    df.attrs["history_provider"] = "replay"
+    return df[df.index >= get_period_start(period_str, end=df.index[-1])]
+
+# Yahoo Finance 下載
+def yahoo_download(tickers, **kwargs):
+    """參數與 yf.download 相同"""
+    return yf.download(tickers, **kwargs)
+
+# 本地歷史數據庫設置
+HISTORY_STORE_PATH = os.environ.get("STOCK_HISTORY_DB", "/tmp/stock_history/ohlcv.db")
+# 同一股票在此秒數內已更新過則不再向數據源請求
+HISTORY_REFRESH_SECONDS = 900
+# 各時間週期對應的日曆天數
+PERIOD_DAYS = {"1mo": 30, "3mo": 90, "6mo": 180, "1y": 365, "2y": 730}
+
+# 連接本地歷史數據庫
+def get_history_connection():
+    """打開 SQLite 歷史數據庫，必要時建立資料表"""
+    os.makedirs(os.path.dirname(HISTORY_STORE_PATH), exist_ok=True)
+    conn = sqlite3.connect(HISTORY_STORE_PATH, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS ohlcv (
+            provider TEXT NOT NULL,
+            symbol TEXT NOT NULL,
+            date TEXT NOT NULL,
+            open REAL, high REAL, low REAL, close REAL, volume REAL,
+            PRIMARY KEY (provider, symbol, date)
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS ohlcv_meta (
+            provider TEXT NOT NULL,
+            symbol TEXT NOT NULL,
+            covered_from TEXT NOT NULL,
+            last_date TEXT NOT NULL,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (provider, symbol)
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS indicator_state (
+            provider TEXT NOT NULL,
+            symbol TEXT NOT NULL,
+            state TEXT NOT NULL,
+            PRIMARY KEY (provider, symbol)
+        )
+    """)
+    return conn
+
+# 統一數據格式的欄位與價格精度（可設 STOCK_OHLC_DTYPE=float32 以節省記憶體）
+OHLC_COLUMNS = ['Open', 'High', 'Low', 'Close']
+OHLC_DTYPE = np.dtype(os.environ.get("STOCK_OHLC_DTYPE", "float64"))
+
+# 檢查數據是否已是統一格式
+def is_canonical_ohlcv(df, dtype=OHLC_DTYPE):
+    """欄位、類型及索引都符合統一格式時返回 True"""
+    return (
+        list(df.columns) == OHLC_COLUMNS + ['Volume']
+        and all(df[col].dtype == dtype for col in OHLC_COLUMNS)
+        and df['Volume'].dtype == np.int64
+        and isinstance(df.index, pd.DatetimeIndex)
+        and df.index.tz is None
+        and df.index.is_monotonic_increasing
+        and df.index.is_unique
+        and not df['Close'].isna().any()
+    )
+
+# 將各數據源的數據轉為統一的 OHLCV 格式
+def normalize_ohlcv(df, dtype=OHLC_DTYPE):
+    """轉為單層欄位、連續的浮點數 OHLC 區塊、int64 成交量及排序去重的 DatetimeIndex
+    
+    已是統一格式的數據直接返回，不會複製。
+    """
+    if df is None:
+        return None
+    if is_canonical_ohlcv(df, dtype):
+        return df
+    if df.empty:
+        out = pd.DataFrame(np.empty((0, len(OHLC_COLUMNS)), dtype=dtype), index=pd.DatetimeIndex([], name='Date'), columns=OHLC_COLUMNS)
+        out['Volume'] = np.empty(0, dtype=np.int64)
+        return out
+    
+    # yfinance 的 (欄位, 代碼) 多層欄位只保留欄位名稱
+    columns = df.columns.get_level_values(0) if isinstance(df.columns, pd.MultiIndex) else df.columns
+    values = {name: df.iloc[:, i] for i, name in enumerate(columns) if name in OHLC_COLUMNS + ['Volume']}
+    
+    index = pd.DatetimeIndex(pd.to_datetime(df.index))
+    if index.tz is not None:
+        index = index.tz_localize(None)
+    
+    ohlc = np.column_stack([pd.to_numeric(values[col], errors='coerce').to_numpy(dtype=dtype) for col in OHLC_COLUMNS])
+    volume = pd.to_numeric(values['Volume'], errors='coerce').fillna(0).to_numpy().astype(np.int64)
+    
+    # 按日期排序，相同日期保留最後一筆，並移除沒有收盤價的行
+    order = np.argsort(index.values, kind='stable')
+    index, ohlc, volume = index[order], ohlc[order], volume[order]
+    keep = ~index.duplicated(keep='last') & ~np.isnan(ohlc[:, 3])
+    
+    out = pd.DataFrame(np.ascontiguousarray(ohlc[keep]), index=index[keep], columns=OHLC_COLUMNS)
+    out['Volume'] = volume[keep]
+    out.index.name = 'Date'
+    # 保留數據來源等標記
+    out.attrs.update(df.attrs)
+    return out
+
+# 讀取本地數據庫中股票的覆蓋範圍
+def get_history_meta(provider, symbol):
+    """返回 (covered_from, last_date, updated_at)，沒有記錄時返回 None"""
+    conn = get_history_connection()
+    try:
+        row = conn.execute(
+            "SELECT covered_from, last_date, updated_at FROM ohlcv_meta WHERE provider = ? AND symbol = ?",
+            (provider, symbol)
+        ).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    return pd.Timestamp(row[0]), pd.Timestamp(row[1]), row[2]
+
+# 從本地數據庫讀取股票歷史數據
+def load_history(provider, symbol, start_date=None):
+    """讀取本地數據庫中的歷史數據，沒有數據時返回 None"""
+    conn = get_history_connection()
+    try:
+        query = "SELECT date, open, high, low, close, volume FROM ohlcv WHERE provider = ? AND symbol = ?"
+        params = [provider, symbol]
+        if start_date is not None:
+            query += " AND date >= ?"
+            params.append(pd.Timestamp(start_date).strftime("%Y-%m-%d"))
+        df = pd.read_sql_query(query + " ORDER BY date", conn, params=params, parse_dates=['date'], index_col='date')
+    finally:
+        conn.close()
+    if df.empty:
+        return None
+    df.columns = ['Open', 'High', 'Low', 'Close', 'Volume']
+    df = normalize_ohlcv(df)
+    # 記錄數據來源，評分時據此讀取對應的指標狀態
+    df.attrs["history_provider"] = provider
     return df
 
-# 從 Alpha Vantage 獲取數據
-@st.cache_data(ttl=3600)
+# 將歷史數據寫入本地數據庫
+def save_history(provider, symbol, df, covered_from):
+    """寫入（或覆蓋）歷史數據並更新覆蓋範圍記錄"""
+    df = normalize_ohlcv(df)
+    if df.empty:
+        return
+    rows = [
+        (provider, symbol, ts.strftime("%Y-%m-%d"), float(o), float(h), float(l), float(c), int(v))
+        for ts, o, h, l, c, v in zip(df.index, df['Open'], df['High'], df['Low'], df['Close'], df['Volume'])
+    ]
+    covered_from = pd.Timestamp(covered_from).strftime("%Y-%m-%d")
+    last_date = df.index[-1].strftime("%Y-%m-%d")
+    # 第一次寫入或歷史起點提前時，指標狀態需由完整歷史重建
+    meta = get_history_meta(provider, symbol)
+    rebuild = meta is None or meta[0] > pd.Timestamp(covered_from)
+    conn = get_history_connection()
+    try:
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO ohlcv VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            conn.execute("""
+                INSERT INTO ohlcv_meta (provider, symbol, covered_from, last_date, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (provider, symbol) DO UPDATE SET
+                    covered_from = MIN(covered_from, excluded.covered_from),
+                    last_date = MAX(last_date, excluded.last_date),
+                    updated_at = excluded.updated_at
+            """, (provider, symbol, covered_from, last_date, time.time()))
+    finally:
+        conn.close()
+    # 所有寫入路徑（增量請求、批量預取、後台預熱）都同步更新指標狀態
+    refresh_stream_state(provider, symbol, rebuild=rebuild)
+
+# 更新歷史數據的檢查時間
+def touch_history(provider, symbol):
+    conn = get_history_connection()
+    try:
+        with conn:
+            conn.execute("UPDATE ohlcv_meta SET updated_at = ? WHERE provider = ? AND symbol = ?",
+                         (time.time(), provider, symbol))
+    finally:
+        conn.close()
+
+# 讀取保存的增量指標狀態
+def load_stream_state(provider, symbol):
+    conn = get_history_connection()
+    try:
+        row = conn.execute(
+            "SELECT state FROM indicator_state WHERE provider = ? AND symbol = ?", (provider, symbol)
+        ).fetchone()
+    finally:
+        conn.close()
+    return json.loads(row[0]) if row else None
+
+# 保存增量指標狀態
+def save_stream_state(provider, symbol, state):
+    conn = get_history_connection()
+    try:
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO indicator_state (provider, symbol, state) VALUES (?, ?, ?)",
+                (provider, symbol, json.dumps(state))
+            )
+    finally:
+        conn.close()
+
+# 將已完成的K線加入保存的指標狀態
+def refresh_stream_state(provider, symbol, rebuild=False):
+    """只讀取並加入狀態之後、今日之前的K線；沒有狀態、參數改變或 rebuild 時由完整歷史重建"""
+    today = pd.Timestamp.now().normalize()
+    state = None if rebuild else load_stream_state(provider, symbol)
+    if state is None or state["params"] != STREAM_PARAMS:
+        history = load_history(provider, symbol)
+        if history is None:
+            return None
+        state = build_stream_state(history[history.index < today])
+    else:
+        bars = load_history(provider, symbol, start_date=state["last_date"])
+        if bars is None:
+            return state
+        if state["last_date"] is not None:
+            bars = bars[bars.index > pd.Timestamp(state["last_date"])]
+        bars = bars[bars.index < today]
+        if bars.empty:
+            return state
+        for date, close in zip(bars.index, bars['Close']):
+            update_stream_state(state, float(close), date.strftime("%Y-%m-%d"))
+    save_stream_state(provider, symbol, state)
+    return state
+
+# 獲取股票指標的最新值
+def get_stream_indicators(provider, symbol):
+    """已完成的K線來自保存的狀態，今日未完成的K線只試算而不寫入狀態"""
+    state = refresh_stream_state(provider, symbol)
+    if state is None:
+        return None
+    today_bars = load_history(provider, symbol, start_date=pd.Timestamp.now().normalize())
+    if today_bars is None:
+        return stream_state_values(state)
+    return update_stream_state(copy.deepcopy(state), float(today_bars['Close'].iloc[-1]),
+                               today_bars.index[-1].strftime("%Y-%m-%d"))
+
+# 以本地數據庫為基礎增量獲取歷史數據
+def get_incremental_history(provider, symbol, start_date, fetch_range):
+    """只向數據源請求本地沒有的日期，寫入數據庫後返回 start_date 之後的數據
+    
+    fetch_range(symbol, from_date, to_date) 需返回該區間的 DataFrame 或 None
+    """
+    start_date = pd.Timestamp(start_date).normalize()
+    today = pd.Timestamp.now().normalize()
+    
+    meta = get_history_meta(provider, symbol)
+    
+    if meta is None or meta[0] > start_date:
+        # 沒有記錄或覆蓋範圍不足，下載完整區間
+        df = fetch_range(symbol, start_date, today)
+        if df is None or df.empty:
+            return load_history(provider, symbol, start_date)
+        save_history(provider, symbol, df, start_date)
+    else:
+        covered_from, last_date, updated_at = meta
+        # 最後一根K線（包括當日未完成的K線）超過刷新間隔後重新請求；last_date 早於今天時同樣受此間隔限制，
+        # 避免週末或假日沒有新數據時每次執行都請求
+        if time.time() - updated_at > HISTORY_REFRESH_SECONDS:
+            # 從最後一根K線開始請求，覆蓋當日可能未完成的數據
+            df = fetch_range(symbol, last_date, today)
+            if df is not None and not df.empty:
+                save_history(provider, symbol, df, covered_from)
+            else:
+                # 數據源沒有新數據（或暫停使用），記錄這次檢查的時間
+                touch_history(provider, symbol)
+    
+    return load_history(provider, symbol, start_date)
+
+# 熔斷器設置：連續失敗次數達到閾值後暫停使用該數據源
+CIRCUIT_FAILURE_THRESHOLD = 3
+CIRCUIT_COOLDOWN = 120
+
+# 進程內共享的數據源健康狀態
+@st.cache_resource
+def get_provider_health():
+    """每個數據源記錄 closed（正常）/ open（暫停）/ half_open（試探中）狀態"""
+    providers = {
+        provider: {"state": "closed", "failures": 0, "opened_at": 0.0, "probe_at": 0.0, "cooldown": CIRCUIT_COOLDOWN, "last_error": None}
+        for provider in PROVIDER_NAMES
+    }
+    return {"lock": threading.Lock(), "providers": providers}
+
+# 檢查數據源是否可用
+def provider_available(provider, replay=None):
+    """暫停中的數據源返回 False；冷卻時間過後只放行一個試探請求
+    
+    replay 為 None 時使用本次執行的回放設置；背景執行緒需明確傳入。
+    """
+    if replay_mode if replay is None else replay:
+        return True
+    registry = get_provider_health()
+    with registry["lock"]:
+        health = registry["providers"].get(provider)
+        if health is None or health["state"] == "closed":
+            return True
+        now = time.time()
+        if health["state"] == "open":
+            if now - health["opened_at"] < health["cooldown"]:
+                return False
+            health["state"] = "half_open"
+            health["probe_at"] = now
+            return True
+        # 試探請求長時間沒有結果時視為失敗，重新暫停一個冷卻期
+        if now - health["probe_at"] >= health["cooldown"]:
+            health["failures"] += 1
+            health.update(state="open", opened_at=now, last_error="試探請求沒有結果")
+        return False
+
+# 記錄數據源請求成功（回放模式不影響實際的熔斷狀態）
+def record_provider_success(provider, replay=None):
+    if replay_mode if replay is None else replay:
+        return
+    registry = get_provider_health()
+    with registry["lock"]:
+        health = registry["providers"].get(provider)
+        if health is not None:
+            health.update(state="closed", failures=0, last_error=None)
+
+# 記錄數據源請求失敗
+def record_provider_failure(provider, error, trip=False, cooldown=CIRCUIT_COOLDOWN, replay=None):
+    """trip 為 True 時（如認證失敗、已達呼叫限制）立即暫停該數據源；回放模式不記錄"""
+    if replay_mode if replay is None else replay:
+        return
+    registry = get_provider_health()
+    with registry["lock"]:
+        health = registry["providers"].get(provider)
+        if health is None:
+            return
+        health["failures"] += 1
+        health["last_error"] = error
+        if trip or health["state"] == "half_open" or health["failures"] >= CIRCUIT_FAILURE_THRESHOLD:
+            health.update(state="open", opened_at=time.time(), cooldown=cooldown)
+
+# 試探請求被取消時，讓下一個請求立即重新試探
+def release_provider_probe(provider):
+    registry = get_provider_health()
+    with registry["lock"]:
+        health = registry["providers"].get(provider)
+        if health is not None and health["state"] == "half_open":
+            health.update(state="open", opened_at=time.time() - health["cooldown"])
+
+# 記錄沒有明確成敗的請求（如代碼無效、返回的數據不足）
+def record_provider_inconclusive(provider, error, replay=None):
+    """正常狀態下不影響熔斷計數；試探中的請求沒有成功即視為失敗，避免停留在試探狀態"""
+    if replay_mode if replay is None else replay:
+        return
+    registry = get_provider_health()
+    with registry["lock"]:
+        health = registry["providers"].get(provider)
+        probing = health is not None and health["state"] == "half_open"
+    if probing:
+        record_provider_failure(provider, error, replay=replay)
+
+# 獲取所有數據源的健康狀態快照
+def get_provider_health_snapshot():
+    """返回 {數據源: (狀態, 剩餘冷卻秒數, 最後錯誤)}"""
+    registry = get_provider_health()
+    now = time.time()
+    with registry["lock"]:
+        return {
+            provider: (
+                health["state"],
+                max(0.0, health["cooldown"] - (now - health["opened_at"])) if health["state"] == "open" else 0.0,
+                health["last_error"],
+            )
+            for provider, health in registry["providers"].items()
+        }
+
+# HTTP 連接池與重試設置
+HTTP_POOL_SIZES = {"alphavantage": 4, "finnhub": 8}
+HTTP_RETRY_STATUS = {429, 500, 502, 503, 504}
+HTTP_MAX_RETRIES = 3
+HTTP_BACKOFF_BASE = 0.5
+HTTP_BACKOFF_MAX = 8.0
+
+# 各數據源的顯示名稱
+PROVIDER_NAMES = {"yahoo": "Yahoo Finance", "alphavantage": "Alpha Vantage", "finnhub": "Finnhub"}
+# 各數據源的請求配額：(每個週期的請求數, 週期秒數, 每日上限)
+PROVIDER_RATE_LIMITS = {"alphavantage": (5, 60, 25), "finnhub": (60, 60, None)}
+# 預計等待超過此秒數時不發出請求
+RATE_LIMIT_MAX_WAIT = 120
+
+# 配額已用完時拋出，讓調用方像其他連線錯誤一樣切換數據源
+class RateLimitExceeded(requests.exceptions.RequestException):
+    pass
+
+# 競速請求中已有其他數據源勝出時拋出；不視為數據源失敗
+class RequestCancelled(Exception):
+    pass
+
+# 每個執行緒的請求設置；fetch_hedged 的工作執行緒在此放置取消標記
+request_context = threading.local()
+
+# 等待指定秒數，期間請求被取消時提前返回 True
+def wait_unless_cancelled(seconds):
+    event = getattr(request_context, "cancel_event", None)
+    if event is None:
+        time.sleep(seconds)
+        return False
+    return event.wait(seconds)
+
+# 當前執行緒的請求是否已被取消
+def request_cancelled():
+    event = getattr(request_context, "cancel_event", None)
+    return event is not None and event.is_set()
+
+# 數據獲取過程中的頁面訊息，介面與 st 的訊息函數相同
+class ThreadNotifier:
+    """當前執行緒設為靜默（如全市場篩選）時不輸出訊息，spinner 返回空的上下文"""
+    def __getattr__(self, name):
+        if getattr(request_context, "quiet", False):
+            return contextlib.nullcontext if name == "spinner" else (lambda *args, **kwargs: None)
+        return getattr(st, name)
+
+notify = ThreadNotifier()
+
+# 在 with 區塊內按 quiet 設置當前執行緒的訊息輸出
+@contextlib.contextmanager
+def quiet_messages(quiet=True):
+    previous = getattr(request_context, "quiet", False)
+    request_context.quiet = quiet
+    try:
+        yield
+    finally:
+        request_context.quiet = previous
+
+# 進程內共享的請求配額令牌桶，所有用戶會話共用
+@st.cache_resource
+def get_rate_limiters():
+    """每個數據源一個令牌桶，令牌可為負數以表示已排隊的預約"""
+    buckets = {}
+    for provider, (calls, seconds, daily_limit) in PROVIDER_RATE_LIMITS.items():
+        buckets[provider] = {
+            "capacity": float(calls),
+            "tokens": float(calls),
+            "rate": calls / seconds,
+            "updated": time.monotonic(),
+            "daily_limit": daily_limit,
+            "day": datetime.now().date(),
+            "day_count": 0,
+        }
+    return {"lock": threading.Lock(), "buckets": buckets}
+
+# 按經過時間補充令牌
+def refill_bucket(bucket, now):
+    bucket["tokens"] = min(bucket["capacity"], bucket["tokens"] + (now - bucket["updated"]) * bucket["rate"])
+    bucket["updated"] = now
+    today = datetime.now().date()
+    if bucket["day"] != today:
+        bucket["day"] = today
+        bucket["day_count"] = 0
+
+# 預約一個請求名額並等待到可發送的時間
+def acquire_rate_limit(provider, max_wait=RATE_LIMIT_MAX_WAIT):
+    """按先來先到排隊；當日配額已用完或預計等待過長時返回 False
+    
+    等待期間請求被取消時歸還名額並拋出 RequestCancelled。
+    """
+    limiters = get_rate_limiters()
+    with limiters["lock"]:
+        bucket = limiters["buckets"].get(provider)
+        if bucket is None:
+            return True
+        refill_bucket(bucket, time.monotonic())
+        if bucket["daily_limit"] is not None and bucket["day_count"] >= bucket["daily_limit"]:
+            return False
+        wait = max(0.0, (1 - bucket["tokens"]) / bucket["rate"])
+        if wait > max_wait:
+            return False
+        bucket["tokens"] -= 1
+        bucket["day_count"] += 1
+    
+    if wait > 0:
+        notify.caption(f"{PROVIDER_NAMES.get(provider, provider)} 請求配額限制，預計等待 {wait:.0f} 秒")
+        if wait_unless_cancelled(wait):
+            with limiters["lock"]:
+                bucket["tokens"] += 1
+                bucket["day_count"] = max(0, bucket["day_count"] - 1)
+            raise RequestCancelled(provider)
+    return True
+
+# 估計發出多個請求需要的等待時間
+def estimate_rate_limit_wait(provider, requests_count=1):
+    """返回再發出 requests_count 個請求預計需要等待的秒數，當日配額不足時返回 None"""
+    limiters = get_rate_limiters()
+    with limiters["lock"]:
+        bucket = limiters["buckets"].get(provider)
+        if bucket is None:
+            return 0.0
+        refill_bucket(bucket, time.monotonic())
+        if bucket["daily_limit"] is not None and bucket["day_count"] + requests_count > bucket["daily_limit"]:
+            return None
+        return max(0.0, (requests_count - bucket["tokens"]) / bucket["rate"])
+
+# 數據源回報已達呼叫限制時，暫停發出請求
+def mark_rate_limited(provider, cooldown=60):
+    """將令牌桶清空，使下一個請求至少在 cooldown 秒後才發出"""
+    limiters = get_rate_limiters()
+    with limiters["lock"]:
+        bucket = limiters["buckets"].get(provider)
+        if bucket is None:
+            return
+        refill_bucket(bucket, time.monotonic())
+        bucket["tokens"] = min(bucket["tokens"], 1 - cooldown * bucket["rate"])
+
+# 進程內共享的 HTTP 連接池，每個數據源一個
+@st.cache_resource
+def get_http_session(provider):
+    """建立保持連線的 Session，連接池大小按數據源設定"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZES.get(provider, 4), max_retries=0)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+# 使用共享連接池發送 GET 請求
+def http_get(provider, url, **kwargs):
+    """對連線錯誤和可重試的狀態碼以帶隨機抖動的指數退避重試"""
+    session = get_http_session(provider)
+    kwargs.setdefault("timeout", 15)
+    
+    for attempt in range(HTTP_MAX_RETRIES + 1):
+        # 競速中已落後的請求不再發出，也不佔用配額
+        if request_cancelled():
+            release_provider_probe(provider)
+            raise RequestCancelled(provider)
+        # 每次嘗試（包括重試）都計入配額，不發出必定被拒絕的請求
+        if not acquire_rate_limit(provider):
+            raise RateLimitExceeded(f"{PROVIDER_NAMES.get(provider, provider)} 請求配額已用完")
+        retry_after = None
+        try:
+            response = session.get(url, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            if attempt == HTTP_MAX_RETRIES:
+                raise
+        else:
+            if response.status_code not in HTTP_RETRY_STATUS or attempt == HTTP_MAX_RETRIES:
+                return response
+            # 429/503 可能附帶伺服器建議的等待秒數
+            try:
+                retry_after = float(response.headers.get("Retry-After", ""))
+            except ValueError:
+                retry_after = None
+        
+        delay = min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * (2 ** attempt))
+        if retry_after is not None:
+            wait_unless_cancelled(min(HTTP_BACKOFF_MAX, retry_after))
+        else:
+            wait_unless_cancelled(random.uniform(0, delay))
+
+# 從 Alpha Vantage 獲取數據（快取由 get_alpha_vantage_planned 負責）
 def get_alpha_vantage_data(symbol, outputsize="full"):
     """從 Alpha Vantage API 獲取股票數據"""
     try:
-        st.info(f"正在從 Alpha Vantage 獲取 {symbol} 數據")
+        notify.info(f"正在從 Alpha Vantage 獲取 {symbol} 數據")
         
         # 调试信息
         if not ALPHA_VANTAGE_API_KEY:
-            st.error("Alpha Vantage API 密鑰未設置")
+            notify.error("Alpha Vantage API 密鑰未設置")
             return None
             
         url = f"https://www.alphavantage.co/query?function=TIME_SERIES_DAILY&symbol={symbol}&outputsize={outputsize}&apikey={ALPHA_VANTAGE_API_KEY}"
-        st.caption(f"API URL: {url}")
+        notify.caption(f"API URL: {url}")
         
-        r = requests.get(url, timeout=15)  # 延长超时时间
+        r = http_get("alphavantage", url, timeout=15)  # 延长超时时间
         
         # 检查HTTP错误
         if r.status_code != 200:
-            st.error(f"Alpha Vantage API 錯誤: HTTP {r.status_code}")
+            notify.error(f"Alpha Vantage API 錯誤: HTTP {r.status_code}")
+            record_provider_failure("alphavantage", f"HTTP {r.status_code}")
             return None
             
         data = r.json()
         
         # 打印返回的错误信息
         if "Error Message" in data:
-            st.error(f"Alpha Vantage API 錯誤: {data['Error Message']}")
+            notify.error(f"Alpha Vantage API 錯誤: {data['Error Message']}")
+            record_provider_inconclusive("alphavantage", data['Error Message'])
             return None
             
         if "Information" in data:
-            st.warning(f"Alpha Vantage API 信息: {data['Information']}")
+            notify.warning(f"Alpha Vantage API 信息: {data['Information']}")
             if "Thank you for using Alpha Vantage" in data.get("Information", ""):
-                st.error("API 密鑰可能已達到呼叫限制")
+                notify.error("API 密鑰可能已達到呼叫限制")
+                mark_rate_limited("alphavantage")
+                record_provider_failure("alphavantage", "已達呼叫限制", trip=True, cooldown=60)
                 return None
                 
         if "Time Series (Daily)" not in data:
-            st.warning(f"無法從 Alpha Vantage 獲取 {symbol} 的數據")
+            notify.warning(f"無法從 Alpha Vantage 獲取 {symbol} 的數據")
+            record_provider_inconclusive("alphavantage", "沒有返回時間序列")
             return None
             
         # 提取時間序列數據
@@ -359,7 +1505,8 @@ def get_alpha_vantage_data(symbol, outputsize="full"):
         
         # 檢查是否為空或無效
         if not time_series or len(time_series) < 5:
-            st.warning(f"從 Alpha Vantage 獲取的 {symbol} 數據不足")
+            notify.warning(f"從 Alpha Vantage 獲取的 {symbol} 數據不足")
+            record_provider_inconclusive("alphavantage", "數據不足")
             return None
             
         # 轉換為 Pandas DataFrame
@@ -374,23 +1521,21 @@ def get_alpha_vantage_data(symbol, outputsize="full"):
             '5. volume': 'Volume'
         })
         
-        # 轉換為數值類型
-        for col in ['Open', 'High', 'Low', 'Close']:
-            df[col] = pd.to_numeric(df[col])
-        df['Volume'] = pd.to_numeric(df['Volume'])
-        
-        # 設置日期索引
-        df.index = pd.to_datetime(df.index)
-        
-        # 按日期排序
-        df = df.sort_index()
+        # 轉為統一格式（數值類型、日期索引並排序）
+        df = normalize_ohlcv(df)
         
+        record_provider_success("alphavantage")
         return df
+    except RequestCancelled:
+        # 由 fetch_hedged 取消，不記錄為失敗，也不更新本地數據庫的檢查時間
+        raise
     except requests.exceptions.RequestException as e:
-        st.warning(f"連接 Alpha Vantage 時出錯: {str(e)}")
+        notify.warning(f"連接 Alpha Vantage 時出錯: {str(e)}")
+        record_provider_failure("alphavantage", str(e))
         return None
     except Exception as e:
-        st.warning(f"獲取 Alpha Vantage 數據時出錯: {str(e)}")
+        notify.warning(f"獲取 Alpha Vantage 數據時出錯: {str(e)}")
+        record_provider_inconclusive("alphavantage", str(e))
         return None
 
 # 添加Finnhub API key
@@ -401,10 +1546,10 @@ FINNHUB_API_KEY = "cn4r15pr01qo43g8d77gcn4r15pr01qo43g8d780"
 def get_finnhub_data(symbol, from_date=None, to_date=None):
     """從Finnhub API獲取股票數據"""
     try:
-        st.info(f"正在從Finnhub獲取{symbol}數據")
+        notify.info(f"正在從Finnhub獲取{symbol}數據")
         
         if not FINNHUB_API_KEY:
-            st.error("Finnhub API密鑰未設置")
+            notify.error("Finnhub API密鑰未設置")
             return None
             
         # 設置日期範圍 (如果未指定，使用過去6個月)
@@ -427,15 +1572,17 @@ def get_finnhub_data(symbol, from_date=None, to_date=None):
             # 構建API URL
             url = f'https://finnhub.io/api/v1/stock/candle?symbol={symbol}&resolution=D&from={from_date}&to={to_date}'
             
-            response = requests.get(url, headers=headers, timeout=15)
+            response = http_get("finnhub", url, headers=headers, timeout=15)
             
             # 檢查回應狀態
             if response.status_code != 200:
-                st.error(f"Finnhub API錯誤: 狀態碼 {response.status_code}")
+                notify.error(f"Finnhub API錯誤: 狀態碼 {response.status_code}")
                 if response.status_code == 403:
-                    st.error(f"Finnhub API認證失敗: 請檢查API密鑰或訂閱權限")
-                    st.warning("切換到Yahoo Finance數據源...")
+                    notify.error(f"Finnhub API認證失敗: 請檢查API密鑰或訂閱權限")
+                    notify.warning("切換到Yahoo Finance數據源...")
+                    record_provider_failure("finnhub", "認證失敗 (HTTP 403)", trip=True, cooldown=3600)
                     return None
+                record_provider_failure("finnhub", f"HTTP {response.status_code}")
                 return None
                 
             # 解析JSON回應
@@ -443,8 +1590,9 @@ def get_finnhub_data(symbol, from_date=None, to_date=None):
             
             # 檢查響應是否有效
             if candle_data.get('s') != 'ok':
-                st.warning(f"無法從Finnhub獲取{symbol}的數據：{candle_data.get('s')}")
-                st.warning("切換到Yahoo Finance數據源...")
+                notify.warning(f"無法從Finnhub獲取{symbol}的數據：{candle_data.get('s')}")
+                notify.warning("切換到Yahoo Finance數據源...")
+                record_provider_inconclusive("finnhub", f"狀態 {candle_data.get('s')}")
                 return None
                 
             # 創建Pandas DataFrame
@@ -456,37 +1604,417 @@ def get_finnhub_data(symbol, from_date=None, to_date=None):
                 'Volume': candle_data['v']
             })
             
-            # 將時間戳轉換為日期索引
+            # 將時間戳轉換為日期索引，並轉為統一格式
             df.index = pd.to_datetime(candle_data['t'], unit='s')
-            
-            # 按日期排序
-            df = df.sort_index()
+            df = normalize_ohlcv(df)
             
             # 檢查數據是否有效
             if df.empty or len(df) < 5:
-                st.warning(f"從Finnhub獲取的{symbol}數據不足")
-                st.warning("切換到Yahoo Finance數據源...")
+                notify.warning(f"從Finnhub獲取的{symbol}數據不足")
+                notify.warning("切換到Yahoo Finance數據源...")
+                record_provider_inconclusive("finnhub", "數據不足")
                 return None
                 
+            record_provider_success("finnhub")
             return df
             
         except requests.exceptions.RequestException as e:
-            st.error(f"Finnhub API連接錯誤: {str(e)}")
-            st.warning("切換到Yahoo Finance數據源...")
+            notify.error(f"Finnhub API連接錯誤: {str(e)}")
+            record_provider_failure("finnhub", str(e))
+            notify.warning("切換到Yahoo Finance數據源...")
             return None
     except Exception as e:
-        st.error(f"獲取Finnhub數據時出錯: {str(e)}")
-        st.warning("切換到Yahoo Finance數據源...")
+        notify.error(f"獲取Finnhub數據時出錯: {str(e)}")
+        notify.warning("切換到Yahoo Finance數據源...")
+        record_provider_inconclusive("finnhub", str(e))
         return None
 
-# 獲取股票數據的函數
-def get_stock_data(symbol, period_str="6mo"):
+# Yahoo Finance 批量下載的每批股票數量
+YAHOO_BATCH_SIZE = 20
+
+# 批量預先下載的 Yahoo Finance 數據，鍵為 (股票代碼, 時間週期)
+yahoo_batch_frames = {}
+
+# 批量從 Yahoo Finance 獲取多個股票數據
+def get_yahoo_batch_data(symbols, period_str="6mo", chunk_size=YAHOO_BATCH_SIZE, threads=True, replay=None, on_error=None):
+    """以分塊的多股票請求下載數據，並拆分為各股票的 DataFrame
+    
+    on_error 接收錯誤訊息，預設顯示在頁面上；replay 見 provider_available。
+    """
+    on_error = on_error or notify.warning
+    frames = {}
+    unique_symbols = list(dict.fromkeys(symbols))
+    
+    for start in range(0, len(unique_symbols), chunk_size):
+        if not provider_available("yahoo", replay=replay):
+            break
+        chunk = unique_symbols[start:start + chunk_size]
+        try:
+            raw = yahoo_download(chunk, period=period_str, progress=False, group_by='column', threads=threads)
+        except Exception as e:
+            on_error(f"Yahoo Finance 批量下載失敗: {str(e)}")
+            record_provider_failure("yahoo", str(e), replay=replay)
+            continue
+        
+        # yf.download 出錯時通常返回空的結果而不拋出例外
+        if raw is None or raw.empty:
+            on_error("Yahoo Finance 批量下載沒有返回數據")
+            record_provider_failure("yahoo", "批量下載沒有返回數據", replay=replay)
+            continue
+        record_provider_success("yahoo", replay=replay)
+        
+        for symbol in chunk:
+            try:
+                if isinstance(raw.columns, pd.MultiIndex):
+                    if symbol not in raw.columns.get_level_values(1):
+                        continue
+                    df = raw.xs(symbol, axis=1, level=1)
+                else:
+                    df = raw
+                
+                # 移除該股票沒有交易的日期，並轉為統一格式
+                df = normalize_ohlcv(df.dropna(how='all'))
+                if len(df) >= 5:
+                    frames[symbol] = df
+            except Exception as e:
+                on_error(f"拆分 {symbol} 的批量數據時出錯: {str(e)}")
+    
+    return frames
+
+# 預先批量下載股票清單的 Yahoo Finance 數據
+def prefetch_yahoo_data(symbols, period_str="6mo"):
+    """批量下載並存入 yahoo_batch_frames，返回成功的股票數量"""
+    # 已在預熱快取中的股票不需要下載
+    symbols = [symbol for symbol in symbols if get_warm_frame(symbol, period_str) is None]
+    if not symbols:
+        return 0
+    frames = get_yahoo_batch_data(symbols, period_str)
+    start_date = get_period_start(period_str)
+    for symbol, df in frames.items():
+        df.attrs["history_provider"] = "yahoo"
+        yahoo_batch_frames[(symbol, period_str)] = df
+        try:
+            save_history("yahoo", symbol, df, start_date)
+        except sqlite3.Error as e:
+            st.warning(f"本地數據庫寫入失敗: {str(e)}")
+    return len(frames)
+
+# 從 Yahoo Finance 下載指定日期區間的數據
+def fetch_yahoo_range(symbol, from_date, to_date):
+    """下載 from_date 至 to_date（含）的 Yahoo Finance 數據"""
+    if not provider_available("yahoo"):
+        return None
+    try:
+        df = yahoo_download(
+            symbol,
+            start=from_date.strftime("%Y-%m-%d"),
+            end=(to_date + timedelta(days=1)).strftime("%Y-%m-%d"),
+            progress=False
+        )
+    except Exception as e:
+        record_provider_failure("yahoo", str(e))
+        raise
+    # 代碼無效或已下市時同樣返回空的結果，單一股票的空結果不能區分兩者，只在試探中視為失敗
+    if df is None or df.empty:
+        record_provider_inconclusive("yahoo", "沒有返回數據")
+        return None
+    record_provider_success("yahoo")
+    return normalize_ohlcv(df)
+
+# Alpha Vantage compact 模式返回的K線數量
+ALPHA_VANTAGE_COMPACT_ROWS = 100
+# Alpha Vantage 數據快取秒數
+ALPHA_VANTAGE_CACHE_TTL = 3600
+
+# 進程內共享的 Alpha Vantage 快取
+@st.cache_resource
+def get_alpha_vantage_cache():
+    """每個股票只保留一份數據，並記錄其 outputsize"""
+    return {"lock": threading.Lock(), "entries": {}}
+
+# 按需要的K線數量選擇 Alpha Vantage 的 outputsize
+def plan_alpha_vantage_outputsize(rows_needed):
+    """不超過 compact 的100根K線時使用 compact，否則使用 full"""
+    return "compact" if rows_needed <= ALPHA_VANTAGE_COMPACT_ROWS else "full"
+
+# 按需要的K線數量獲取 Alpha Vantage 數據
+def get_alpha_vantage_planned(symbol, rows_needed):
+    """優先使用快取，已快取的 full 數據可直接滿足 compact 請求"""
+    outputsize = plan_alpha_vantage_outputsize(rows_needed)
+    cache = get_alpha_vantage_cache()
+    
+    with cache["lock"]:
+        entry = cache["entries"].get(symbol)
+    if entry is not None and time.time() - entry["fetched_at"] < ALPHA_VANTAGE_CACHE_TTL:
+        if entry["outputsize"] == "full" or outputsize == "compact":
+            return entry["df"]
+    
+    df = get_alpha_vantage_data(symbol, outputsize=outputsize)
+    if df is not None and not df.empty:
+        with cache["lock"]:
+            current = cache["entries"].get(symbol)
+            # 不以 compact 數據覆蓋仍然有效的 full 數據
+            keep_current = (
+                current is not None
+                and current["outputsize"] == "full"
+                and outputsize == "compact"
+                and time.time() - current["fetched_at"] < ALPHA_VANTAGE_CACHE_TTL
+            )
+            if not keep_current:
+                cache["entries"][symbol] = {"outputsize": outputsize, "df": df, "fetched_at": time.time()}
+    return df
+
+# 從 Alpha Vantage 下載指定日期區間的數據
+def fetch_alpha_vantage_range(symbol, from_date, to_date):
+    """按區間內的交易日數量規劃 compact 或 full 請求"""
+    if not provider_available("alphavantage"):
+        return None
+    rows_needed = int(np.busday_count(from_date.date(), (to_date + timedelta(days=1)).date()))
+    df = get_alpha_vantage_planned(symbol, rows_needed)
+    if df is None or df.empty:
+        return None
+    return df[df.index >= from_date]
+
+# 從 Finnhub 下載指定日期區間的數據
+def fetch_finnhub_range(symbol, from_date, to_date):
+    """下載 from_date 至 to_date 的 Finnhub 數據"""
+    if not provider_available("finnhub"):
+        return None
+    return get_finnhub_data(symbol, from_date, to_date + timedelta(days=1))
+
+# 計算時間週期的起始日期
+def get_period_start(period_str, trading_days=False, end=None):
+    """trading_days 為 True 時，按交易日數量換算成足夠的日曆天數；end 為終點日期，預設為今天"""
+    days = PERIOD_DAYS.get(period_str, 180)
+    if trading_days:
+        days = int(days * 7 / 5) + 7
+    end = pd.Timestamp.now() if end is None else pd.Timestamp(end)
+    return end.normalize() - timedelta(days=days)
+
+# 以本地數據庫獲取 Alpha Vantage 數據
+def get_alpha_vantage_history(symbol, period_str="6mo"):
+    """增量獲取 Alpha Vantage 數據，數據庫不可用時直接請求 API"""
+    try:
+        return get_incremental_history("alphavantage", symbol, get_period_start(period_str, trading_days=True), fetch_alpha_vantage_range)
+    except sqlite3.Error as e:
+        notify.warning(f"本地數據庫讀寫失敗: {str(e)}")
+        if not provider_available("alphavantage"):
+            return None
+        return get_alpha_vantage_planned(symbol, PERIOD_DAYS.get(period_str, 180))
+
+# 以本地數據庫獲取 Finnhub 數據
+def get_finnhub_history(symbol, from_date, to_date):
+    """增量獲取 Finnhub 數據，數據庫不可用時直接請求 API"""
+    try:
+        df = get_incremental_history("finnhub", symbol, from_date, fetch_finnhub_range)
+        if df is not None:
+            df = df[df.index <= pd.Timestamp(to_date)]
+        return df
+    except sqlite3.Error as e:
+        notify.warning(f"本地數據庫讀寫失敗: {str(e)}")
+        if not provider_available("finnhub"):
+            return None
+        return get_finnhub_data(symbol, from_date, to_date)
+
+# 從 Yahoo Finance 獲取單一股票數據，優先使用批量下載的結果
+def get_yahoo_data(symbol, period_str="6mo"):
+    """從 Yahoo Finance 獲取股票數據"""
+    df = yahoo_batch_frames.get((symbol, period_str))
+    if df is not None:
+        return df
+    df = get_warm_frame(symbol, period_str)
+    if df is not None:
+        return df
+    try:
+        df = get_incremental_history("yahoo", symbol, get_period_start(period_str), fetch_yahoo_range)
+    except sqlite3.Error as e:
+        notify.warning(f"本地數據庫讀寫失敗: {str(e)}")
+        df = fetch_yahoo_range(symbol, get_period_start(period_str), pd.Timestamp.now().normalize())
+    if df is None:
+        return pd.DataFrame()
+    return df
+
+# 背景預熱設置：進程啟動時及每隔一段時間下載觀察清單的歷史數據
+WARM_CACHE_ENABLED = os.environ.get("STOCK_WARM_CACHE", "1") != "0"
+# 預設與預熱數據的有效期（HISTORY_REFRESH_SECONDS）相同，使快取在兩次預熱之間保持有效；設得更長時過期期間會改為增量請求
+WARM_INTERVAL_SECONDS = int(os.environ.get("STOCK_WARM_INTERVAL", str(HISTORY_REFRESH_SECONDS)))
+# 預熱最長的時間週期，較短的週期由其裁剪得到
+WARM_PERIOD = "2y"
+# 每批下載之間的間隔秒數與每批的下載執行緒數
+WARM_CHUNK_PAUSE = 2.0
+WARM_DOWNLOAD_THREADS = 4
+# 用戶觀察清單的最大股票數量
+WARM_MAX_SYMBOLS = 500
+
+# 進程內共享的預熱快取
+@st.cache_resource
+def get_warm_cache():
+    """保存預熱的數據及用戶觀察清單，觀察清單可由 STOCK_WATCHLIST 環境變量預設"""
+    watchlist = [s.strip().upper() for s in os.environ.get("STOCK_WATCHLIST", "").split(",") if s.strip()]
+    return {"lock": threading.Lock(), "frames": {}, "watchlist": dict.fromkeys(watchlist), "last_run": None, "last_error": None}
+
+# 將用戶分析過的股票加入觀察清單
+def register_watchlist(symbols):
+    cache = get_warm_cache()
+    with cache["lock"]:
+        for symbol in symbols:
+            cache["watchlist"].pop(symbol, None)
+            cache["watchlist"][symbol] = None
+        # 超過上限時移除最早加入的股票
+        while len(cache["watchlist"]) > WARM_MAX_SYMBOLS:
+            cache["watchlist"].pop(next(iter(cache["watchlist"])))
+
+# 從預熱快取讀取數據
+def get_warm_frame(symbol, period_str="6mo"):
+    """快取仍然有效時返回 period_str 範圍內的單層欄位數據，否則返回 None
+    
+    有效期與本地數據庫的刷新間隔相同，不會比增量請求的數據更舊；
+    過期後由 get_incremental_history 只補上最後一根K線之後的數據（預熱已寫入數據庫）。
+    """
+    if replay_mode:
+        return None
+    cache = get_warm_cache()
+    with cache["lock"]:
+        entry = cache["frames"].get(symbol)
+    if entry is None or time.time() - entry["loaded_at"] > HISTORY_REFRESH_SECONDS:
+        return None
+    df = entry["df"]
+    df = df[df.index >= get_period_start(period_str)]
+    return df if len(df) >= 5 else None
+
+# 背景預熱的設置，由啟動執行緒的一方明確傳入，執行緒內不讀取任何頁面設置
+WARM_CONFIG = {
+    "period": WARM_PERIOD,
+    "interval": WARM_INTERVAL_SECONDS,
+    "threads": WARM_DOWNLOAD_THREADS,
+    "pause": WARM_CHUNK_PAUSE,
+}
+
+# 下載整個觀察清單的歷史數據
+def warm_watchlist_cache(config=WARM_CONFIG, errors=None):
+    """分批下載，寫入預熱快取和本地數據庫，返回成功的股票數量
+    
+    預熱總是請求實際的數據源（不受某次執行的回放設置影響），錯誤訊息加入 errors 而不寫到頁面。
+    """
+    errors = [] if errors is None else errors
+    cache = get_warm_cache()
+    with cache["lock"]:
+        user_symbols = list(cache["watchlist"])
+    symbols = list(dict.fromkeys(list(get_us_stock_list()) + user_symbols))
+    start_date = get_period_start(config["period"])
+    
+    warmed = 0
+    for start in range(0, len(symbols), YAHOO_BATCH_SIZE):
+        chunk = symbols[start:start + YAHOO_BATCH_SIZE]
+        frames = get_yahoo_batch_data(chunk, config["period"], threads=config["threads"], replay=False, on_error=errors.append)
+        for symbol, df in frames.items():
+            df.attrs["history_provider"] = "yahoo"
+            with cache["lock"]:
+                cache["frames"][symbol] = {"df": df, "loaded_at": time.time()}
+            try:
+                save_history("yahoo", symbol, df, start_date)
+            except sqlite3.Error as e:
+                errors.append(f"本地數據庫寫入失敗: {str(e)}")
+            warmed += 1
+        time.sleep(config["pause"])
+    return warmed
+
+# 啟動背景預熱執行緒，每個進程只啟動一次
+@st.cache_resource
+def start_cache_warmer():
+    """執行緒不屬於任何頁面執行，因此不附加 ScriptRunContext，也不調用 st 的頁面函數；
+    設置以 WARM_CONFIG 明確傳入，結果與錯誤只寫入預熱快取，由側邊欄讀取顯示
+    """
+    cache = get_warm_cache()
+    config = dict(WARM_CONFIG)
+    
+    def _loop():
+        while True:
+            started = time.monotonic()
+            errors = []
+            try:
+                warmed = warm_watchlist_cache(config, errors)
+                with cache["lock"]:
+                    cache["last_run"] = (datetime.now(), warmed)
+                    cache["last_error"] = errors[-1] if errors else None
+            except Exception as e:
+                with cache["lock"]:
+                    cache["last_error"] = str(e)
+            # 間隔從本次預熱開始時計算，下載本身的耗時不會使快取過期
+            time.sleep(max(config["interval"] - (time.monotonic() - started), 0))
+    
+    thread = threading.Thread(target=_loop, name="watchlist-cache-warmer", daemon=True)
+    thread.start()
+    return thread
+
+# 檢查數據是否足夠分析
+def is_valid_frame(df):
+    """至少需要5個數據點"""
+    return df is not None and not df.empty and len(df) >= 5
+
+# 以競速方式向多個數據源請求
+def fetch_hedged(fetchers, hedge_delay=1.5):
+    """先啟動主要數據源，延遲內沒有結果時啟動備援數據源，返回最先得到的有效數據
+    
+    fetchers 為 [(數據源名稱, 無參數函數), ...]，按優先順序排列；
+    返回 (數據源名稱, DataFrame)，全部失敗時返回 (None, None)。
+    落後的請求不會被等待；得到結果後取消其餘請求，尚未發出的 HTTP 請求不再發出，排隊中的配額名額會歸還。
+    """
+    ctx = get_script_run_ctx()
+    cancel_event = threading.Event()
+    quiet = getattr(request_context, "quiet", False)
+    
+    def _run(fetch):
+        add_script_run_ctx(threading.current_thread(), ctx)
+        request_context.cancel_event = cancel_event
+        try:
+            with quiet_messages(quiet):
+                df = fetch()
+        finally:
+            request_context.cancel_event = None
+        return df if is_valid_frame(df) else None
+    
+    executor = ThreadPoolExecutor(max_workers=len(fetchers))
+    try:
+        pending = {}
+        for idx, (name, fetch) in enumerate(fetchers):
+            pending[executor.submit(_run, fetch)] = name
+            is_last = idx == len(fetchers) - 1
+            # 等待延遲時間，或直到已啟動的請求有結果
+            deadline = time.monotonic() + (float("inf") if is_last else hedge_delay)
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                done, _ = wait_futures(pending, timeout=None if is_last else remaining, return_when=FIRST_COMPLETED)
+                if not done:
+                    break
+                failed = False
+                for future in done:
+                    source = pending.pop(future)
+                    try:
+                        df = future.result()
+                    except Exception:
+                        df = None
+                    if df is not None:
+                        return source, df
+                    failed = True
+                # 有請求失敗時立即啟動下一個數據源
+                if failed and not is_last:
+                    break
+        return None, None
+    finally:
+        cancel_event.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+# 從選定的數據源獲取股票數據
+def fetch_stock_data(symbol, period_str="6mo"):
     """獲取股票數據，支持多種數據源"""
     try:
         # 根據選擇的數據源獲取數據
         if data_source == "Alpha Vantage API (實時)":
-            with st.spinner(f"正在從 Alpha Vantage API 獲取 {symbol} 數據..."):
-                df = get_alpha_vantage_data(symbol)
+            with notify.spinner(f"正在從 Alpha Vantage API 獲取 {symbol} 數據..."):
+                df = get_alpha_vantage_history(symbol, period_str)
                 if df is not None and not df.empty and len(df) >= 5:
                     # 裁剪數據以匹配選定的時間範圍
                     if period_str == "1mo":
@@ -499,26 +2027,26 @@ def get_stock_data(symbol, period_str="6mo"):
                         df = df.iloc[-365:]
                     elif period_str == "2y":
                         df = df.iloc[-730:]
-                    st.success(f"成功從 Alpha Vantage 獲取 {symbol} 數據")
+                    notify.success(f"成功從 Alpha Vantage 獲取 {symbol} 數據")
                     return df
                 else:
                     # 如果 Alpha Vantage 失敗，直接切換到Yahoo Finance
-                    st.warning(f"無法從 Alpha Vantage 獲取 {symbol} 的數據")
-                    st.info(f"自動切換到 Yahoo Finance...")
+                    notify.warning(f"無法從 Alpha Vantage 獲取 {symbol} 的數據")
+                    notify.info(f"自動切換到 Yahoo Finance...")
                     try:
-                        with st.spinner(f"正在從 Yahoo Finance 獲取 {symbol} 數據..."):
-                            df = yf.download(symbol, period=period_str, progress=False)
+                        with notify.spinner(f"正在從 Yahoo Finance 獲取 {symbol} 數據..."):
+                            df = get_yahoo_data(symbol, period_str)
                             if not df.empty and len(df) >= 5:
-                                st.success(f"成功從 Yahoo Finance 獲取 {symbol} 數據")
+                                notify.success(f"成功從 Yahoo Finance 獲取 {symbol} 數據")
                                 return df
                             else:
-                                st.error(f"從 Yahoo Finance 獲取的 {symbol} 數據不足")
+                                notify.error(f"從 Yahoo Finance 獲取的 {symbol} 數據不足")
                                 return None
                     except Exception as yahoo_error:
-                        st.error(f"Yahoo Finance 數據獲取也失敗: {str(yahoo_error)}")
+                        notify.error(f"Yahoo Finance 數據獲取也失敗: {str(yahoo_error)}")
                         return None
         elif data_source == "Finnhub API (即時)":
-            with st.spinner(f"正在從Finnhub獲取{symbol}數據..."):
+            with notify.spinner(f"正在從Finnhub獲取{symbol}數據..."):
                 # 根據period_str設置日期範圍
                 to_date = datetime.now()
                 if period_str == "1mo":
@@ -534,50 +2062,73 @@ def get_stock_data(symbol, period_str="6mo"):
                 else:
                     from_date = to_date - timedelta(days=180)  # 默認6個月
                 
-                df = get_finnhub_data(symbol, from_date, to_date)
+                df = get_finnhub_history(symbol, from_date, to_date)
                 if df is not None and not df.empty and len(df) >= 5:
-                    st.success(f"成功從Finnhub獲取{symbol}數據")
+                    notify.success(f"成功從Finnhub獲取{symbol}數據")
                     return df
                 else:
-                    st.warning(f"無法從Finnhub獲取{symbol}的數據")
-                    st.info(f"自動切換到Yahoo Finance...")
+                    notify.warning(f"無法從Finnhub獲取{symbol}的數據")
+                    notify.info(f"自動切換到Yahoo Finance...")
                     try:
-                        with st.spinner(f"正在從Yahoo Finance獲取{symbol}數據..."):
-                            df = yf.download(symbol, period=period_str, progress=False)
+                        with notify.spinner(f"正在從Yahoo Finance獲取{symbol}數據..."):
+                            df = get_yahoo_data(symbol, period_str)
                             if not df.empty and len(df) >= 5:
-                                st.success(f"成功從Yahoo Finance獲取{symbol}數據")
+                                notify.success(f"成功從Yahoo Finance獲取{symbol}數據")
                                 return df
                             else:
-                                st.error(f"從Yahoo Finance獲取的{symbol}數據不足")
+                                notify.error(f"從Yahoo Finance獲取的{symbol}數據不足")
                                 return None
                     except Exception as yahoo_error:
-                        st.error(f"Yahoo Finance數據獲取也失敗: {str(yahoo_error)}")
+                        notify.error(f"Yahoo Finance數據獲取也失敗: {str(yahoo_error)}")
                         return None
+        elif replay_mode:
+            with notify.spinner(f"正在回放 {symbol} 的錄製數據..."):
+                df = replay_stock_data(symbol, period_str)
+                if is_valid_frame(df):
+                    notify.success(f"成功回放 {symbol} 的錄製數據")
+                    return df
+                notify.error(f"找不到 {symbol} 的錄製數據，請先在錄製模式下分析該股票")
+                return None
         elif data_source == "Yahoo Finance (15分鐘延遲)":
-            with st.spinner(f"正在從 Yahoo Finance 獲取 {symbol} 數據..."):
-                df = yf.download(symbol, period=period_str, progress=False)
+            with notify.spinner(f"正在從 Yahoo Finance 獲取 {symbol} 數據..."):
+                df = get_yahoo_data(symbol, period_str)
                 if not df.empty and len(df) >= 5:
-                    st.success(f"成功從 Yahoo Finance 獲取 {symbol} 數據")
+                    notify.success(f"成功從 Yahoo Finance 獲取 {symbol} 數據")
                     return df
                 else:
-                    st.error(f"從 Yahoo Finance 獲取 {symbol} 數據失敗")
+                    notify.error(f"從 Yahoo Finance 獲取 {symbol} 數據失敗")
                     return None
         else:  # 混合模式
-            with st.spinner(f"正在以混合模式獲取 {symbol} 數據..."):
+            if hedged_mode:
+                with notify.spinner(f"正在以混合模式競速獲取 {symbol} 數據..."):
+                    source, df = fetch_hedged([
+                        ("Yahoo Finance", lambda: get_yahoo_data(symbol, period_str)),
+                        ("Alpha Vantage", lambda: get_alpha_vantage_history(symbol, period_str)),
+                    ], hedge_delay=hedge_delay)
+                    if df is None:
+                        notify.error(f"無法從任何數據源獲取 {symbol} 的有效數據")
+                        return None
+                    if source == "Alpha Vantage":
+                        # 裁剪數據以匹配選定的時間範圍
+                        df = df.iloc[-PERIOD_DAYS.get(period_str, 180):]
+                    notify.success(f"成功從{source}獲取{symbol}數據")
+                    return df
+            
+            with notify.spinner(f"正在以混合模式獲取 {symbol} 數據..."):
                 # 首先直接使用Yahoo Finance來確保獲取數據的穩定性
                 try:
-                    df = yf.download(symbol, period=period_str, progress=False)
+                    df = get_yahoo_data(symbol, period_str)
                     if not df.empty and len(df) >= 5:
-                        st.success(f"成功從Yahoo Finance獲取{symbol}數據")
+                        notify.success(f"成功從Yahoo Finance獲取{symbol}數據")
                         return df
                     else:
-                        st.warning(f"從Yahoo Finance獲取的{symbol}數據不足")
+                        notify.warning(f"從Yahoo Finance獲取的{symbol}數據不足")
                 except Exception as yahoo_error:
-                    st.warning(f"Yahoo Finance數據獲取失敗: {str(yahoo_error)}")
+                    notify.warning(f"Yahoo Finance數據獲取失敗: {str(yahoo_error)}")
                 
                 # 嘗試從Alpha Vantage獲取
                 try:
-                    df = get_alpha_vantage_data(symbol)
+                    df = get_alpha_vantage_history(symbol, period_str)
                     if df is not None and not df.empty and len(df) >= 5:
                         # 裁剪數據以匹配選定的時間範圍
                         if period_str == "1mo":
@@ -590,54 +2141,179 @@ def get_stock_data(symbol, period_str="6mo"):
                             df = df.iloc[-365:]
                         elif period_str == "2y":
                             df = df.iloc[-730:]
-                        st.success(f"成功從 Alpha Vantage 獲取 {symbol} 數據")
+                        notify.success(f"成功從 Alpha Vantage 獲取 {symbol} 數據")
                         return df
                     else:
-                        st.error(f"無法從任何數據源獲取 {symbol} 的有效數據")
+                        notify.error(f"無法從任何數據源獲取 {symbol} 的有效數據")
                         return None
                 except Exception as alpha_error:
-                    st.error(f"Alpha Vantage數據獲取失敗: {str(alpha_error)}")
+                    notify.error(f"Alpha Vantage數據獲取失敗: {str(alpha_error)}")
                     return None
         
         # 檢查數據是否有效
         if df is None or df.empty or len(df) < 5:  # 至少需要5個數據點
-            st.error(f"找不到足夠的 {symbol} 數據。請確認代碼正確或嘗試其他數據源。")
+            notify.error(f"找不到足夠的 {symbol} 數據。請確認代碼正確或嘗試其他數據源。")
             return None
         
         return df
     except Exception as e:
-        st.error(f"獲取 {symbol} 數據時出錯: {str(e)}")
+        notify.error(f"獲取 {symbol} 數據時出錯: {str(e)}")
         return None
 
+# 獲取股票數據的函數
+def get_stock_data(symbol, period_str="6mo", quiet=False):
+    """獲取股票數據，所有數據源的結果都轉為統一的 OHLCV 格式；quiet 為 True 時獲取過程不在頁面上顯示訊息"""
+    with quiet_messages(quiet):
+        return fetch_normalized_stock_data(symbol, period_str)
+
+# 獲取並轉換股票數據，錄製模式下保存結果
+def fetch_normalized_stock_data(symbol, period_str):
+    df = fetch_stock_data(symbol, period_str)
+    if df is None:
+        return None
+    try:
+        df = normalize_ohlcv(df)
+    except Exception as e:
+        notify.error(f"轉換 {symbol} 數據格式時出錯: {str(e)}")
+        return None
+    
+    # 錄製最終用於分析的數據，不論來自數據源、本地數據庫還是快取
+    if record_mode and not replay_mode and is_valid_frame(df):
+        try:
+            record_fixture(symbol, df)
+        except Exception as e:
+            notify.warning(f"錄製 {symbol} 的數據失敗: {str(e)}")
+    return df
+
+# 基本信息變化緩慢，快取一天
+FUNDAMENTALS_TTL = 86400
+# 背景載入基本信息的執行緒數量
+FUNDAMENTALS_WORKERS = 8
+# 顯示結果時等待基本信息的最長秒數
+FUNDAMENTALS_WAIT = 5
+
+# 從 Yahoo Finance 獲取基本信息（失敗時拋出例外，避免快取失敗結果）
+@st.cache_data(ttl=FUNDAMENTALS_TTL, show_spinner=False)
+def fetch_stock_info(symbol):
+    """獲取並快取股票的基本信息"""
+    info = yf.Ticker(symbol).info
+    # 無效代碼時 yfinance 可能返回只有少數空欄位的字典
+    if not info or (info.get("shortName") is None and info.get("marketCap") is None):
+        raise ValueError(f"無法獲取 {symbol} 的基本信息")
+    
+    # 提取並返回關鍵信息；缺少的數值為 None，由顯示端格式化為 N/A
+    dividend_yield = info.get("dividendYield")
+    return {
+        "公司名稱": info.get("shortName") or symbol,
+        "行業": info.get("industry") or "N/A",
+        "市值": info.get("marketCap"),
+        "本益比": info.get("trailingPE"),
+        "股息率": dividend_yield * 100 if is_number(dividend_yield) else None,
+        "52週高點": info.get("fiftyTwoWeekHigh"),
+        "52週低點": info.get("fiftyTwoWeekLow"),
+        "平均成交量": info.get("averageVolume"),
+    }
+
 # 獲取股票基本信息
 def get_stock_info(symbol):
-    """獲取股票的基本信息"""
+    """獲取股票的基本信息，失敗時（或回放模式下）返回 None"""
+    if replay_mode:
+        return None
     try:
-        stock = yf.Ticker(symbol)
-        info = stock.info
-        
-        # 提取並返回關鍵信息
-        return {
-            "公司名稱": info.get("shortName", symbol),
-            "行業": info.get("industry", "N/A"),
-            "市值": info.get("marketCap", 0),
-            "本益比": info.get("trailingPE", None),
-            "股息率": info.get("dividendYield", 0) * 100 if info.get("dividendYield") else 0,
-            "52週高點": info.get("fiftyTwoWeekHigh", 0),
-            "52週低點": info.get("fiftyTwoWeekLow", 0),
-            "平均成交量": info.get("averageVolume", 0),
-        }
-    except Exception as e:
-        return {
-            "公司名稱": symbol,
-            "行業": "獲取失敗",
-            "市值": 0,
-            "本益比": None,
-            "股息率": 0,
-            "52週高點": 0,
-            "52週低點": 0,
-            "平均成交量": 0,
-        }
+        return fetch_stock_info(symbol)
+    except Exception:
+        return None
+
+# 進程內共享的基本信息載入執行緒池
+@st.cache_resource
+def get_fundamentals_executor():
+    return ThreadPoolExecutor(max_workers=FUNDAMENTALS_WORKERS)
+
+# 在背景並行載入多個股票的基本信息
+def load_stock_info_batch(symbols):
+    """返回 {代碼: Future}，已快取的股票不會發出請求"""
+    ctx = get_script_run_ctx()
+    executor = get_fundamentals_executor()
+    
+    def _worker(symbol):
+        add_script_run_ctx(threading.current_thread(), ctx)
+        return get_stock_info(symbol)
+    
+    return {symbol: executor.submit(_worker, symbol) for symbol in dict.fromkeys(symbols)}
+
+# 在共同的期限內收集已載入的基本信息
+def collect_stock_infos(futures, timeout=FUNDAMENTALS_WAIT):
+    """所有股票共用一個等待期限，返回 {代碼: 基本信息}，逾時或失敗的股票不包含在內"""
+    done, _ = wait_futures(futures.values(), timeout=timeout)
+    infos = {}
+    for symbol, future in futures.items():
+        if future not in done:
+            continue
+        try:
+            info = future.result()
+        except Exception:
+            info = None
+        if info is not None:
+            infos[symbol] = info
+    return infos
+
+# 基本信息中的數值欄位（數據源可能返回 None、字串或 "Infinity"）
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+# 格式化本益比
+def format_pe_ratio(value):
+    return f"{value:.1f}" if is_number(value) and value > 0 else "N/A"
+
+# 格式化市值
+def format_market_cap(value):
+    """以 T/B/M 為單位顯示市值"""
+    if not is_number(value) or value <= 0:
+        return "N/A"
+    for unit, scale in (("T", 1e12), ("B", 1e9), ("M", 1e6)):
+        if value >= scale:
+            return f"${value / scale:.2f}{unit}"
+    return f"${value:,.0f}"
+
+# 指標快取最多保存的衍生結果數量（指標序列與預測結果）
+INDICATOR_CACHE_SIZE = 512
+
+# 進程內共享的指標快取，按最近使用順序排列
+@st.cache_resource
+def get_indicator_cache():
+    return {"lock": threading.Lock(), "entries": OrderedDict()}
+
+# 數據指紋：數據來源、最後時間戳、長度、最後收盤價及整個收盤價序列的雜湊
+def data_fingerprint(df):
+    """同一股票的數據只要指紋相同，衍生的指標序列就相同
+    
+    數據源修正較早的K線或切換數據源時，最後一根K線可能不變，所以一併比較收盤價序列的雜湊（只需一次線性掃描）。
+    """
+    provider = df.attrs.get("history_provider")
+    if df.empty:
+        return (provider, None, 0, None, None)
+    close = np.ascontiguousarray(df['Close'].to_numpy(dtype=np.float64))
+    return (provider, df.index[-1], len(df), float(close[-1]), hash(close.tobytes()))
+
+# 讀取快取的指標序列，沒有時返回 None
+def lookup_indicator(symbol, df, name, params):
+    key = (symbol, data_fingerprint(df), name, params)
+    cache = get_indicator_cache()
+    with cache["lock"]:
+        value = cache["entries"].get(key)
+        if value is not None:
+            cache["entries"].move_to_end(key)
+    return value
+
+# 保存指標序列，超過容量時移除最久未使用的結果
+def store_indicator(symbol, df, name, params, value):
+    key = (symbol, data_fingerprint(df), name, params)
+    cache = get_indicator_cache()
+    with cache["lock"]:
+        cache["entries"][key] = value
+        cache["entries"].move_to_end(key)
+        while len(cache["entries"]) > INDICATOR_CACHE_SIZE:
+            cache["entries"].popitem(last=False)
 
 # RSI 計算函式
 def compute_rsi(data, window=14):
@@ -657,64 +2333,323 @@ def calculate_rsi(data, window=14):
     return compute_rsi(data, window=window)
 
 # 移動平均線計算
-def add_moving_averages(df, periods):
-    """計算多個周期的移動平均線"""
-    for period in periods:
-        df[f'MA_{period}'] = df['Close'].rolling(window=period).mean()
+def add_moving_averages(df, periods, symbol=None):
+    """計算多個周期的移動平均線；快取中沒有的周期一次滾動統計算出"""
+    indicators = compute_indicators(df, [("MA", period) for period in periods], symbol=symbol)
+    for column in indicators.columns:
+        df[column] = indicators[column]
     return df
 
+# 指標流水線：調用方聲明需要的指標，如 ("RSI", 14)、("MA", 20)、("EMA", 12)、("BB", 20, 2)、("MACD", 12, 26, 9)
+def indicator_outputs(spec):
+    """返回 {輸出欄位: 節點}；節點為元組，相同的中間結果在不同指標間共用同一節點"""
+    close = ("close",)
+    kind = spec[0]
+    if kind == "RSI":
+        return {"RSI": ("rsi", spec[1])}
+    if kind == "RSI_WILDER":
+        return {"RSI_Wilder": ("wilder_rsi", spec[1])}
+    if kind == "MA":
+        return {f"MA_{spec[1]}": ("mean", close, spec[1])}
+    if kind == "EMA":
+        return {f"EMA_{spec[1]}": ("ema", close, spec[1])}
+    if kind == "BB":
+        window, num_std = spec[1], spec[2]
+        return {"BB_upper": ("band", window, num_std, 1), "BB_lower": ("band", window, num_std, -1)}
+    if kind == "MACD":
+        fast, slow, signal = spec[1], spec[2], spec[3]
+        macd = ("diff", ("ema", close, fast), ("ema", close, slow))
+        signal_line = ("ema", macd, signal)
+        return {"MACD": macd, "Signal_Line": signal_line, "MACD_Histogram": ("diff", macd, signal_line)}
+    raise ValueError(f"未知的指標: {kind}")
+
+# 節點的直接依賴
+def indicator_node_deps(node):
+    kind = node[0]
+    if kind == "close":
+        return ()
+    if kind in ("delta", "wilder_rsi"):
+        return (("close",),)
+    if kind in ("gain", "loss"):
+        return (("delta",),)
+    if kind in ("mean", "std"):
+        return (("rolling", node[1]),)
+    if kind in ("rolling", "ema"):
+        return (node[1],)
+    if kind == "rsi":
+        return (("mean", ("gain",), node[1]), ("mean", ("loss",), node[1]))
+    if kind == "band":
+        return (("mean", ("close",), node[1]), ("std", ("close",), node[1]))
+    if kind == "diff":
+        return (node[1], node[2])
+    raise ValueError(f"未知的指標節點: {kind}")
+
+# 規劃計算順序
+def plan_indicators(specs):
+    """返回 (輸出欄位 → 節點, 節點 → 依賴)；後者按依賴順序排列，每個節點只出現一次"""
+    outputs = {}
+    for spec in specs:
+        outputs.update(indicator_outputs(spec))
+    plan = {}
+    
+    def visit(node):
+        if node in plan:
+            return
+        deps = indicator_node_deps(node)
+        for dep in deps:
+            visit(dep)
+        plan[node] = deps
+    
+    for node in outputs.values():
+        visit(node)
+    return outputs, plan
+
+# 按規劃計算所有節點
+def run_indicator_plan(close, plan):
+    """close 為一維收盤價數組；同一序列需要的所有滾動窗口合併為一次 rolling_stats_2d"""
+    windows = {}
+    for node in plan:
+        if node[0] in ("mean", "std"):
+            mean_windows, std_windows = windows.setdefault(node[1], (set(), set()))
+            (mean_windows if node[0] == "mean" else std_windows).add(node[2])
+    
+    values = {}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for node, deps in plan.items():
+            kind = node[0]
+            inputs = [values[dep] for dep in deps]
+            if kind == "close":
+                value = close
+            elif kind == "delta":
+                value = np.concatenate([[np.nan], np.diff(close)])
+            elif kind == "gain":
+                value = np.maximum(inputs[0], 0.0)
+            elif kind == "loss":
+                value = np.maximum(-inputs[0], 0.0)
+            elif kind == "rolling":
+                mean_windows, std_windows = windows[node[1]]
+                value = rolling_stats_2d(inputs[0].reshape(-1, 1), sorted(mean_windows | std_windows), sorted(std_windows))
+            elif kind == "mean":
+                value = inputs[0][0][node[2]][:, 0]
+            elif kind == "std":
+                value = inputs[0][1][node[2]][:, 0]
+            elif kind == "ema":
+                value = ema_2d(inputs[0].reshape(-1, 1), node[2])[:, 0]
+            elif kind == "rsi":
+                value = 100 - 100 / (1 + inputs[0] / inputs[1])
+            elif kind == "wilder_rsi":
+                value = wilder_rsi_values(inputs[0], node[1])
+            elif kind == "band":
+                value = inputs[0] + node[3] * node[2] * inputs[1]
+            else:
+                value = inputs[0] - inputs[1]
+            values[node] = value
+    return values
+
+# 使用指標快取的規格類型（RSI 與 score_stocks 的面板結果共用）
+MEMOIZED_SPECS = ("RSI", "RSI_WILDER", "MA")
+
+# 一次計算多個指標，結果寫入同一個預先分配的 DataFrame
+def compute_indicators(df, specs, symbol=None):
+    """返回只包含指標欄位的 DataFrame，不複製輸入數據；提供 symbol 時 RSI 與均線使用指標快取"""
+    specs = list(dict.fromkeys(specs))
+    cached = {}
+    if symbol is not None:
+        for spec in specs:
+            if spec[0] in MEMOIZED_SPECS:
+                value = lookup_indicator(symbol, df, spec[0], tuple(spec[1:]))
+                if value is not None:
+                    cached[spec] = value
+    
+    outputs, plan = plan_indicators([spec for spec in specs if spec not in cached])
+    values = run_indicator_plan(df['Close'].to_numpy(dtype=np.float64), plan) if plan else {}
+    
+    columns = [column for spec in specs for column in indicator_outputs(spec)]
+    out = np.empty((len(df), len(columns)))
+    for spec in specs:
+        for column, node in indicator_outputs(spec).items():
+            index = columns.index(column)
+            if spec in cached:
+                out[:, index] = cached[spec].to_numpy()
+            else:
+                out[:, index] = values[node]
+                if symbol is not None and spec[0] in MEMOIZED_SPECS:
+                    store_indicator(symbol, df, spec[0], tuple(spec[1:]), pd.Series(values[node], index=df.index, name=column))
+    return pd.DataFrame(out, index=df.index, columns=columns)
+
+# 將一維收盤價數組的列表排成 時間 × 股票 的數組，較短的歷史在末尾補 NaN
+def pad_columns(closes):
+    lengths = np.array([len(close) for close in closes], dtype=np.int64)
+    values = np.full((int(lengths.max()) if len(closes) else 0, len(closes)), np.nan)
+    for j, close in enumerate(closes):
+        values[:len(close), j] = close
+    return values, lengths
+
+# 面板上每個交易日的線性趨勢預測：以累積和一次求出所有股票、所有日期的最小二乘斜率與截距
+def expanding_linear_forecast(values, days=5):
+    """values 為 時間 × 股票；第 t 行以該股票截至 t 的數據擬合 y = a + b·x（x 為該股票的第幾個觀測），
+    返回 時間 × 股票 × days 的預測，該股票沒有數據的位置為 NaN
+    """
+    valid = ~np.isnan(values)
+    counts = valid.sum(axis=0)
+    # 先減去各欄平均值，減少累積和的捨入誤差（斜率與截距不受影響）
+    center = np.where(valid, values, 0.0).sum(axis=0) / np.maximum(counts, 1)
+    y = np.where(valid, values - center, 0.0)
+    n = np.cumsum(valid, axis=0).astype(np.float64)
+    x = np.where(valid, n - 1, 0.0)
+    sum_y = np.cumsum(y, axis=0)
+    sum_xy = np.cumsum(x * y, axis=0)
+    sum_x = n * (n - 1) / 2
+    sum_xx = (n - 1) * n * (2 * n - 1) / 6
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = (n * sum_xy - sum_x * sum_y) / (n * sum_xx - sum_x ** 2)
+        intercept = (sum_y - slope * sum_x) / n + center
+    future_x = n[:, :, None] - 1 + np.arange(1, days + 1)
+    forecast = intercept[:, :, None] + slope[:, :, None] * future_x
+    return np.where(valid[:, :, None], forecast, np.nan)
+
+# Holt 指數平滑的參數網格，每個股票選取一步預測誤差平方和最小的組合
+HOLT_ALPHAS = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9)
+HOLT_BETAS = (0.01, 0.05, 0.1, 0.2, 0.3)
+
+# 面板上每個交易日的 Holt（水平 + 趨勢）指數平滑預測
+def holt_forecast_path(values, days=5, alphas=HOLT_ALPHAS, betas=HOLT_BETAS):
+    """values 為 時間 × 股票，返回 時間 × 股票 × days 的預測
+    
+    所有股票與所有參數組合沿時間軸一起遞推，每一步只是一次數組運算；第 t 行使用截至 t 的誤差平方和最小的參數。
+    缺失值及較短歷史之後的位置沿用前一狀態。
+    """
+    rows, symbols = values.shape
+    out = np.full((rows, symbols, days), np.nan)
+    # 以第二個觀測值為初始水平、前兩個觀測值之差為初始趨勢
+    if rows < 2:
+        return out
+    
+    grid = np.array([(alpha, beta) for alpha in alphas for beta in betas])
+    combos = len(grid)
+    alpha = np.tile(grid[:, 0], symbols)
+    beta = np.tile(grid[:, 1], symbols)
+    steps = np.arange(1, days + 1)
+    columns = np.arange(symbols)
+    
+    level = np.repeat(values[1], combos)
+    trend = np.repeat(values[1] - values[0], combos)
+    sse = np.zeros(symbols * combos)
+    for t in range(1, rows):
+        if t >= 2:
+            y = np.repeat(values[t], combos)
+            valid = ~np.isnan(y)
+            forecast = level + trend
+            new_level = alpha * y + (1 - alpha) * forecast
+            new_trend = beta * (new_level - level) + (1 - beta) * trend
+            sse += np.where(valid, (y - forecast) ** 2, 0.0)
+            level = np.where(valid, new_level, level)
+            trend = np.where(valid, new_trend, trend)
+        best = sse.reshape(symbols, combos).argmin(axis=1)
+        best_level = level.reshape(symbols, combos)[columns, best]
+        best_trend = trend.reshape(symbols, combos)[columns, best]
+        out[t] = best_level[:, None] + best_trend[:, None] * steps
+    return out
+
+# 預測模型的配置；修改模型時一併修改，使舊的快取結果失效
+FORECAST_MODEL = ("linear+holt", HOLT_ALPHAS, HOLT_BETAS)
+
+# 線性模型與 Holt 模型的權重（Yahoo Finance 只使用線性模型）
+def forecast_weights():
+    if data_source == "Yahoo Finance (15分鐘延遲)":
+        return 1.0, 0.0
+    if data_source == "Alpha Vantage API (實時)":
+        return 0.6, 0.4  # 60% 線性模型, 40% 指數模型
+    return 0.5, 0.5  # 50% 線性模型, 50% 指數模型
+
+# 收盤價預測：分析結果取每支股票最後一行，回測取每個交易日的一行
+def expanding_forecast(values, days=5):
+    """values 為 時間 × 股票，返回 時間 × 股票 × days 的預測價格；第 t 行只使用截至 t 的數據"""
+    linear_weight, holt_weight = forecast_weights()
+    forecast = expanding_linear_forecast(values, days)
+    if holt_weight:
+        forecast = linear_weight * forecast + holt_weight * holt_forecast_path(values, days)
+    return forecast
+
+# 預測快取的參數：加權方式取決於 data_source，所以一併作為鍵
+def forecast_cache_params(days):
+    return (days, FORECAST_MODEL, data_source)
+
+# 批量預測多個股票
+def predict_future_prices_batch(frames, days=5):
+    """frames 為 {代碼: DataFrame}；快取命中的股票不再擬合，其餘的股票一次擬合，返回 {代碼: (未來日期, 預測價格, 變動百分比)}"""
+    params = forecast_cache_params(days)
+    predictions = {}
+    for symbol, df in frames.items():
+        cached = lookup_indicator(symbol, df, "FORECAST", params)
+        if cached is not None:
+            predictions[symbol] = cached
+    
+    symbols = [symbol for symbol in frames if symbol not in predictions]
+    if symbols:
+        values, lengths = pad_columns([frames[symbol]['Close'].to_numpy(dtype=np.float64) for symbol in symbols])
+        # 每支股票取其最後一個觀測所在行的預測
+        forecasts = expanding_forecast(values, days=days)[lengths - 1, np.arange(len(symbols))]
+        for i, symbol in enumerate(symbols):
+            predictions[symbol] = predict_future_prices(frames[symbol], days=days, forecast=forecasts[i])
+            # 預測失敗時不快取，下次執行重新嘗試
+            if predictions[symbol][1]:
+                store_indicator(symbol, frames[symbol], "FORECAST", params, predictions[symbol])
+    return {symbol: predictions[symbol] for symbol in frames}
+
+# 蒙地卡羅模擬的設置
+MC_PERCENTILES = (5, 50, 95)
+MC_SEED = 42
+# 每批模擬的元素上限（股票數 × 路徑數 × 天數），限制峰值記憶體
+MC_CHUNK_ELEMENTS = 4_000_000
+
+# 以預測路徑為中心的蒙地卡羅價格區間
+def monte_carlo_bands(closes, forecasts, n_paths=10000, percentiles=MC_PERCENTILES, seed=MC_SEED,
+                      chunk_elements=MC_CHUNK_ELEMENTS):
+    """closes 為一維收盤價數組的列表，forecasts 為 predict_future_prices 的預測（股票 × 天數）
+    
+    每條路徑從該股票去均值的歷史日對數收益中重抽樣並累加，乘上預測路徑，使中位數沿預測價格移動；
+    按批處理股票，每批最多 chunk_elements 個模擬值。返回 股票 × 百分位 × 天數 的數組。
+    """
+    forecasts = np.asarray(forecasts, dtype=np.float64)
+    symbols, days = forecasts.shape
+    rng = np.random.default_rng(seed)
+    
+    # 各股票去均值的日對數收益，按最長歷史補齊
+    returns = [np.diff(np.log(close[~np.isnan(close)])) for close in closes]
+    lengths = np.array([len(r) for r in returns])
+    padded = np.zeros((symbols, max(int(lengths.max()) if symbols else 0, 1)))
+    for i, r in enumerate(returns):
+        if len(r):
+            padded[i, :len(r)] = r - r.mean()
+    
+    bands = np.full((symbols, len(percentiles), days), np.nan)
+    step = max(1, chunk_elements // (n_paths * days))
+    for start in range(0, symbols, step):
+        rows = np.arange(start, min(start + step, symbols))
+        picks = (rng.random((len(rows), n_paths, days)) * lengths[rows, None, None]).astype(np.int64)
+        shocks = np.cumsum(padded[rows[:, None, None], picks], axis=2)
+        # exp 為單調函數，先取累積收益的百分位再換算價格
+        quantiles = np.percentile(shocks, percentiles, axis=1)
+        bands[rows] = forecasts[rows, None, :] * np.exp(np.moveaxis(quantiles, 0, 1))
+    bands[lengths == 0] = np.nan
+    return bands
+
 # 預測未來股價變化 - 增強版本
-def predict_future_prices(data, days=5):
-    """預測未來多日股價 - 使用多種模型並平均結果"""
+def predict_future_prices(data, days=5, forecast=None):
+    """預測未來多日股價 - 線性趨勢與 Holt 指數平滑按數據源加權（見 expanding_forecast）；forecast 為批量擬合已得到的預測"""
     try:
         # 確保數據足夠
         if len(data) < 5:
             st.warning("數據點不足，無法進行準確預測")
             return [], [], 0.0
-            
-        data = data.copy()
-        data['day'] = np.arange(len(data))
-        
-        # 建立線性迴歸模型
-        model = LinearRegression()
-        X = data[['day']]
-        y = data['Close']
-        model.fit(X, y)
-        
-        # 預測未來價格 - 線性模型
-        future_days = np.arange(len(data), len(data) + days)
-        future_X = pd.DataFrame({'day': future_days})
-        future_prices_linear_raw = model.predict(future_X)
         
-        # 逐个处理，避免数组到标量的转换警告
-        future_prices_linear = [float(price[0]) for price in future_prices_linear_raw]  # Extract single element from array
-        
-        # 模擬第二種預測方法 - 指數平滑
-        future_prices_exp = None
-        if data_source != "Yahoo Finance (15分鐘延遲)":
-            # 模擬第二種預測方法的結果
-            np.random.seed(42)  # 確保可重現性
-            random_factors = np.random.normal(0, 0.01, size=len(future_prices_linear))
-            
-            # 逐个处理，避免批量操作
-            future_prices_exp = []
-            for i in range(len(future_prices_linear)):
-                exp_price = future_prices_linear[i] * (1 + random_factors[i])
-                future_prices_exp.append(float(exp_price))
-            
-            # 合併兩種預測結果 (加權平均)
-            if data_source == "Alpha Vantage API (實時)":
-                weights = [0.6, 0.4]  # 60% 線性模型, 40% 指數模型
-            else:
-                weights = [0.5, 0.5]  # 50% 線性模型, 50% 指數模型
-                
-            # 計算加權平均
-            future_prices = []
-            for i in range(len(future_prices_linear)):
-                weighted_price = weights[0] * future_prices_linear[i] + weights[1] * future_prices_exp[i]
-                future_prices.append(float(weighted_price))
-        else:
-            future_prices = future_prices_linear
+        # 與回測共用同一個預測模型
+        if forecast is None:
+            forecast = expanding_forecast(data['Close'].to_numpy(dtype=np.float64).reshape(-1, 1), days=days)[-1, 0]
+        if not np.isfinite(forecast).all():
+            raise ValueError("收盤價含有缺失值")
+        future_prices = forecast.tolist()
         
         # 產生未來日期
         last_date = data.index[-1]
@@ -727,18 +2662,8 @@ def predict_future_prices(data, days=5):
             if next_date.weekday() < 5:  # 0-4 是週一至週五
                 future_dates.append(next_date)
         
-        # 計算變化百分比 - 使用iloc[0]而非item()方法
-        try:
-            current_price_series = data['Close'].iloc[-1]
-            if hasattr(current_price_series, 'iloc'):
-                current_price = float(current_price_series.iloc[0])
-            elif hasattr(current_price_series, 'item'):
-                current_price = current_price_series.item()
-            else:
-                current_price = float(current_price_series)
-        except:
-            # 回退到直接转换
-            current_price = float(data['Close'].iloc[-1])
+        # 計算變化百分比
+        current_price = float(data['Close'].iloc[-1])
         
         # 安全处理最后一个预测价格
         if future_prices and len(future_prices) > 0:
@@ -757,22 +2682,16 @@ def predict_future_prices(data, days=5):
         return [], [], 0.0
 
 # 計算交易訊號
-def calculate_signals(df, rsi_window, oversold, overbought):
+def calculate_signals(df, rsi_window, oversold, overbought, symbol=None):
     """計算買賣訊號"""
-    df = df.copy()
-    
-    # 計算RSI
-    df['RSI'] = compute_rsi(df, window=rsi_window)
-    
-    # 計算20和50日均線
-    df['MA_20'] = df['Close'].rolling(window=20).mean()
-    df['MA_50'] = df['Close'].rolling(window=50).mean()
+    # 一次計算RSI和20、50日均線
+    df = compute_indicators(df, [("RSI", rsi_window), ("MA", 20), ("MA", 50)], symbol=symbol)
     
     # 產生訊號
     signals = []
     
     # RSI訊號
-    latest_rsi = df['RSI'].iloc[-1].item() if hasattr(df['RSI'].iloc[-1], 'item') else float(df['RSI'].iloc[-1])
+    latest_rsi = float(df['RSI'].iloc[-1])
         
     if latest_rsi < oversold:
         signals.append(("BUY", "RSI超賣"))
@@ -853,16 +2772,227 @@ if not ALPHA_VANTAGE_API_KEY:
 # 添加计算最新收盘价和涨跌幅的安全函数
 def safe_get_latest_price(df):
     try:
-        return float(df['Close'].iloc[-1].iloc[0])
+        return float(df['Close'].iloc[-1])
     except:
         return 0.0
 
 def safe_get_change_pct(df):
     try:
-        return float(df['Close'].pct_change().iloc[-1].iloc[0])
+        return float(df['Close'].pct_change().iloc[-1])
     except:
         return 0.0
 
+# 分析股票代碼格式並獲取數據
+def load_stock(symbol, period_str, quiet=False):
+    """返回 (代碼, DataFrame)，無法獲取數據時返回 None；quiet 為 True 時不顯示代碼提示與錯誤"""
+    # 分析股票代碼格式
+    formatted_symbol, market_type = analyze_symbol(symbol)
+    if formatted_symbol != symbol:
+        if not quiet:
+            st.info(f"原始代碼 {symbol} {market_type}")
+        symbol = formatted_symbol
+
+    # 獲取股票數據
+    df = get_stock_data(symbol, period_str, quiet=quiet)
+
+    # 檢查數據有效性
+    if df is None or df.empty or len(df) < 5:
+        if not quiet:
+            st.error(f"{symbol} 無法獲取數據，請確認代碼正確")
+        return None
+    return symbol, df
+
+# 從增量指標狀態讀取最新 RSI
+def lookup_stream_rsi(symbol, df, rsi_window):
+    """數據來自本地數據庫且狀態已更新至數據最後一天時，返回增量狀態的 RSI，否則返回 None"""
+    provider = df.attrs.get("history_provider")
+    if provider is None or replay_mode or rsi_window != STREAM_PARAMS["rsi_window"]:
+        return None
+    try:
+        values = get_stream_indicators(provider, symbol)
+    except sqlite3.Error:
+        return None
+    if values is None or values["RSI"] is None or values["Date"] != df.index[-1].strftime("%Y-%m-%d"):
+        return None
+    return float(values["RSI"])
+
+# 以面板方式計算多個股票的指標並生成訊號
+def score_stocks(frames, rsi_window=14, oversold=30, overbought=70):
+    """frames 為 {代碼: DataFrame}；RSI 以面板一次計算，返回結果列與詳細分析所需的數據"""
+    if not frames:
+        return []
+    
+    # 只為指標快取和增量指標狀態都沒有的股票計算面板 RSI
+    latest_rsis = {}
+    missing = {}
+    for symbol, df in frames.items():
+        cached = lookup_indicator(symbol, df, "RSI", (rsi_window,))
+        if cached is not None:
+            latest_rsis[symbol] = float(cached.iloc[-1])
+            continue
+        stream_rsi = lookup_stream_rsi(symbol, df, rsi_window)
+        if stream_rsi is not None:
+            latest_rsis[symbol] = stream_rsi
+        else:
+            missing[symbol] = df
+    
+    if missing:
+        closes = build_close_panel(missing)
+        indicators = compute_panel_indicators(closes, rsi_window=rsi_window, ma_periods=(), bb_window=None, macd_params=None)
+        latest_rsis.update(latest_panel_values(indicators['RSI'], closes).to_dict())
+        for symbol, df in missing.items():
+            # 面板按每支股票自己的交易日計算，結果與 compute_rsi 相同，可供圖表重用
+            store_indicator(symbol, df, "RSI", (rsi_window,), indicators['RSI'][symbol].reindex(df.index))
+
+    # 所有股票的線性趨勢一次擬合
+    predictions = predict_future_prices_batch(frames, days=5)
+
+    analyses = []
+    for symbol, df in frames.items():
+        try:
+            # 獲取最新收盤價
+            latest_close = float(df['Close'].iloc[-1])
+            latest_rsi = float(latest_rsis[symbol])
+
+            # 生成訊號
+            if latest_rsi < oversold:
+                rsi_signal = "買入"
+            elif latest_rsi > overbought:
+                rsi_signal = "賣出"
+            else:
+                rsi_signal = "觀望"
+
+            # 預測價格
+            future_dates, future_prices, price_change = predictions[symbol]
+
+            # 預測訊號
+            if price_change > 3:
+                pred_signal = "買入"
+            elif price_change < -3:
+                pred_signal = "賣出"
+            else:
+                pred_signal = "觀望"
+
+            # 合併訊號
+            if rsi_signal == "買入" and pred_signal == "買入":
+                overall_signal = "強烈買入"
+            elif rsi_signal == "賣出" and pred_signal == "賣出":
+                overall_signal = "強烈賣出"
+            elif rsi_signal == "買入" or pred_signal == "買入":
+                overall_signal = "買入"
+            elif rsi_signal == "賣出" or pred_signal == "賣出":
+                overall_signal = "賣出"
+            else:
+                overall_signal = "觀望"
+
+            analyses.append({
+                "symbol": symbol,
+                "df": df,
+                "latest_rsi": latest_rsi,
+                "price_change": price_change,
+                "future_dates": future_dates,
+                "future_prices": future_prices,
+                "row": {
+                    "代碼": symbol,
+                    "收盤價": f"${latest_close:.2f}",
+                    "RSI": f"{latest_rsi:.1f}",
+                    "預測變動": f"{price_change:.2f}%",
+                    "RSI信號": rsi_signal,
+                    "預測信號": pred_signal,
+                    "整體建議": overall_signal,
+                    "raw_price_change": price_change  # 用於排序
+                }
+            })
+        except Exception as e:
+            st.error(f"分析 {symbol} 過程中出錯: {str(e)}")
+    return analyses
+
+# 以有界執行緒池並行獲取多個股票的數據
+def load_stocks_parallel(symbols, period_str, max_workers, on_progress=None, quiet=False):
+    """並行執行 load_stock，結果按提交順序返回，進度按完成順序回報"""
+    # 工作執行緒需要綁定當前的腳本上下文才能輸出Streamlit訊息
+    ctx = get_script_run_ctx()
+
+    def _worker(symbol):
+        add_script_run_ctx(threading.current_thread(), ctx)
+        return load_stock(symbol, period_str, quiet=quiet)
+
+    outcomes = [None] * len(symbols)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(_worker, symbol): idx for idx, symbol in enumerate(symbols)}
+        for done, future in enumerate(as_completed(futures), start=1):
+            idx = futures[future]
+            try:
+                outcomes[idx] = future.result()
+            except Exception as e:
+                st.error(f"分析 {symbols[idx]} 過程中出錯: {str(e)}")
+            if on_progress is not None:
+                on_progress(done, len(symbols), symbols[idx])
+    return outcomes
+
+# 全市場篩選的每批股票數量
+SCREENER_CHUNK_SIZE = 50
+# S&P 500 成分股清單
+SP500_CONSTITUENTS_URL = "https://raw.githubusercontent.com/datasets/s-and-p-500-companies/main/data/constituents.csv"
+
+# 載入篩選的股票範圍（失敗時拋出例外，避免快取失敗結果）
+@st.cache_data(ttl=86400)
+def load_symbol_universe(name):
+    """返回股票代碼列表"""
+    if name == "S&P 500":
+        response = requests.get(SP500_CONSTITUENTS_URL, timeout=15)
+        response.raise_for_status()
+        constituents = pd.read_csv(io.StringIO(response.text))
+        # Yahoo Finance 以連字號表示股份類別，例如 BRK-B
+        return [symbol.replace(".", "-") for symbol in constituents["Symbol"].astype(str)]
+    return list(get_us_stock_list())
+
+# 分批篩選股票範圍，逐批更新排名表格
+def run_screener(symbols, period_str, chunk_size=SCREENER_CHUNK_SIZE):
+    """每批獲取數據並評分後只保留結果列，釋放該批的原始數據，峰值記憶體與股票範圍的大小無關"""
+    progress_bar = st.progress(0)
+    status_placeholder = st.empty()
+    table_placeholder = st.empty()
+    rows = []
+    failed = 0
+    
+    for start in range(0, len(symbols), chunk_size):
+        chunk = symbols[start:start + chunk_size]
+        status_placeholder.markdown(f"<p style='color: #555;'>正在篩選第 {start + 1}-{start + len(chunk)} 支股票 (共 {len(symbols)} 支)...</p>", unsafe_allow_html=True)
+        
+        formatted_chunk = [analyze_symbol(symbol)[0] for symbol in chunk]
+        scored = 0
+        try:
+            if data_source in ["Yahoo Finance (15分鐘延遲)", "混合模式 (推薦)"]:
+                prefetch_yahoo_data(formatted_chunk, period_str)
+            loaded = load_stocks_parallel(chunk, period_str, max(int(max_workers), 1), quiet=True)
+            frames = dict(item for item in loaded if item is not None)
+            analyses = score_stocks(frames, rsi_window=rsi_window, oversold=oversold_threshold, overbought=overbought_threshold)
+            rows.extend(analysis["row"] for analysis in analyses)
+            scored = len(analyses)
+            del loaded, frames, analyses
+        except Exception as e:
+            # 單一批次失敗只計入無法獲取的數量，不中斷整個篩選
+            status_placeholder.warning(f"第 {start + 1}-{start + len(chunk)} 支股票篩選失敗: {str(e)}")
+        finally:
+            # 釋放本批的原始數據
+            for symbol in formatted_chunk:
+                yahoo_batch_frames.pop((symbol, period_str), None)
+        failed += len(chunk) - scored
+        
+        if rows:
+            rows.sort(key=lambda row: row["raw_price_change"], reverse=True)
+            table_placeholder.dataframe(
+                pd.DataFrame(rows).drop(columns=["raw_price_change"]),
+                use_container_width=True,
+                hide_index=True
+            )
+        progress_bar.progress(int(min(start + chunk_size, len(symbols)) / len(symbols) * 100))
+    
+    if not rows:
+        table_placeholder.info("沒有可顯示的篩選結果")
+    status_placeholder.markdown(f"<p style='color: #4CAF50; font-weight: bold;'>✓ 篩選完成: {len(rows)} 支股票" + (f"，{failed} 支無法獲取數據" if failed else "") + "</p>", unsafe_allow_html=True)
+
 # 搜索與股票輸入區域 - 完全重新設計，添加動態效果和動畫
 st.markdown("""
 <div class="stock-input-container" style="animation: fadeIn 0.6s ease-out;">
@@ -929,17 +3059,83 @@ with col2:
     # 使用現代化的分析按鈕
     search_button = st.button("分析", key="hidden-button")  # Remove label_visibility parameter
     
-    # 改進的API狀態顯示
-    if data_source in ["Alpha Vantage API (實時)", "Finnhub API (即時)", "混合模式 (推薦)"]:
-        st.markdown("""
+    # 改進的API狀態顯示，按數據源健康狀態顯示
+    provider_health = get_provider_health_snapshot()
+    badge_providers = {
+        "Alpha Vantage API (實時)": ["alphavantage"],
+        "Finnhub API (即時)": ["finnhub"],
+        "混合模式 (推薦)": ["yahoo", "alphavantage"],
+    }.get(data_source)
+    if badge_providers:
+        paused = [PROVIDER_NAMES[p] for p in badge_providers if provider_health[p][0] != "closed"]
+        if not paused:
+            badge_color, badge_bg, badge_text = "#2E7D32", "#E8F5E9", "API 已連接"
+        elif len(paused) < len(badge_providers):
+            badge_color, badge_bg, badge_text = "#EF6C00", "#FFF3E0", f"部分 API 暫停: {', '.join(paused)}"
+        else:
+            badge_color, badge_bg, badge_text = "#C62828", "#FFEBEE", "API 暫停使用"
+        st.markdown(f"""
         <div style="text-align: center; margin-top: 8px;">
-            <span style="color: #2E7D32; font-size: 0.85rem; background-color: #E8F5E9; padding: 4px 10px; border-radius: 4px; box-shadow: 0 1px 2px rgba(0,0,0,0.05); display: inline-flex; align-items: center;">
-                <svg width="16" height="16" viewBox="0 0 24 24" style="margin-right: 4px;"><path fill="#2E7D32" d="M9,16.17L4.83,12l-1.42,1.41L9,19 21,7l-1.41-1.41L9,16.17z"></path></svg>
-                API 已連接
+            <span style="color: {badge_color}; font-size: 0.85rem; background-color: {badge_bg}; padding: 4px 10px; border-radius: 4px; box-shadow: 0 1px 2px rgba(0,0,0,0.05); display: inline-flex; align-items: center;">
+                <svg width="16" height="16" viewBox="0 0 24 24" style="margin-right: 4px;"><path fill="{badge_color}" d="M9,16.17L4.83,12l-1.42,1.41L9,19 21,7l-1.41-1.41L9,16.17z"></path></svg>
+                {badge_text}
             </span>
         </div>
         """, unsafe_allow_html=True)
 
+# 在側邊欄顯示各數據源的健康狀態
+with st.sidebar:
+    st.markdown("""
+    <div style="margin: 20px 0 10px 0; padding-top: 10px; border-top: 1px solid #eee;">
+        <h3 style="font-size: 1rem; color: #424242; margin: 0 0 10px 0;">數據源狀態</h3>
+    </div>
+    """, unsafe_allow_html=True)
+    
+    for provider, (state, remaining, last_error) in provider_health.items():
+        if state == "closed":
+            state_label = "🟢 正常"
+        elif state == "half_open":
+            state_label = "🟡 試探中"
+        else:
+            state_label = f"🔴 暫停 ({remaining:.0f} 秒後重試)"
+        st.caption(f"{PROVIDER_NAMES[provider]}: {state_label}" + (f" — {last_error}" if last_error else ""))
+    
+    # 背景預熱觀察清單的歷史數據
+    if WARM_CACHE_ENABLED and not replay_mode:
+        start_cache_warmer()
+        warm_cache = get_warm_cache()
+        with warm_cache["lock"]:
+            warm_last_run, warm_error = warm_cache["last_run"], warm_cache["last_error"]
+        if warm_error:
+            st.caption(f"預熱快取: 🔴 {warm_error}")
+        elif warm_last_run:
+            st.caption(f"預熱快取: {warm_last_run[1]} 支股票，更新於 {warm_last_run[0]:%H:%M}")
+        else:
+            st.caption("預熱快取: 載入中...")
+
+# 全市場篩選
+with st.expander("全市場篩選"):
+    screener_universe = st.selectbox("股票範圍", ["主要美股", "S&P 500", "自訂清單"])
+    custom_universe = st.text_area("自訂股票清單（以逗號或換行分隔）", disabled=screener_universe != "自訂清單")
+    screener_chunk_size = st.number_input("每批股票數", min_value=10, max_value=200, value=SCREENER_CHUNK_SIZE, step=10)
+    screener_button = st.button("開始篩選", key="screener-button")
+
+if screener_button:
+    try:
+        if screener_universe == "自訂清單":
+            universe = [symbol.strip().upper() for symbol in re.split(r"[,\s]+", custom_universe) if symbol.strip()]
+        else:
+            universe = load_symbol_universe(screener_universe)
+    except Exception as e:
+        st.error(f"載入股票範圍失敗: {str(e)}")
+        universe = []
+    
+    if universe:
+        st.subheader(f"{screener_universe} 篩選結果")
+        run_screener(list(dict.fromkeys(universe)), period, chunk_size=int(screener_chunk_size))
+    elif screener_universe == "自訂清單":
+        st.warning("請輸入至少一個股票代碼")
+
 # 當用戶點擊分析按鈕
 if search_button:
     # 優先使用手動輸入的股票代碼，如果沒有再使用下拉選擇的代碼
@@ -974,6 +3170,7 @@ if search_button:
         
         progress_bar = st.progress(0)
         status_placeholder = st.empty()
+        quota_placeholder = st.empty()
         
         # 在多個股票時顯示比較信息
         if len(symbols) > 1:
@@ -985,87 +3182,74 @@ if search_button:
             
         # 創建表格來儲存分析結果
         results = []
-        
-        # 分析每個股票
-        for idx, symbol in enumerate(symbols):
-            # 更新進度
-            progress = int((idx / len(symbols)) * 100)
-            progress_bar.progress(progress)
-            status_placeholder.markdown(f"<p style='color: #555;'>正在分析 {symbol}... ({idx+1}/{len(symbols)})</p>", unsafe_allow_html=True)
+        loaded = []
+
+        # 在背景載入基本信息，與價格數據的獲取同時進行
+        formatted_symbols = [analyze_symbol(symbol)[0] for symbol in symbols]
+        stock_info_futures = load_stock_info_batch(formatted_symbols)
+        if not replay_mode:
+            register_watchlist(formatted_symbols)
+
+        # Yahoo Finance 為主要數據源時，先以批量請求下載所有股票
+        if len(symbols) > 1 and data_source in ["Yahoo Finance (15分鐘延遲)", "混合模式 (推薦)"]:
+            status_placeholder.markdown(f"<p style='color: #555;'>正在批量下載 {len(symbols)} 支股票數據...</p>", unsafe_allow_html=True)
+            prefetch_yahoo_data(formatted_symbols, period)
+
+        # API 為主要數據源時，顯示請求配額預計的等待時間
+        quota_provider = {"Alpha Vantage API (實時)": "alphavantage", "Finnhub API (即時)": "finnhub"}.get(data_source)
+        if quota_provider:
+            quota_wait = estimate_rate_limit_wait(quota_provider, len(symbols))
+            if quota_wait is None:
+                quota_placeholder.warning(f"{PROVIDER_NAMES[quota_provider]} 今日請求配額不足，部分股票將改用 Yahoo Finance")
+            elif quota_wait > 0:
+                quota_placeholder.info(f"{PROVIDER_NAMES[quota_provider]} 請求配額限制，最多需等待約 {quota_wait:.0f} 秒")
+
+        # 獲取每個股票的數據
+        if max_workers > 1 and len(symbols) > 1:
+            # 並行獲取，進度條按完成數量更新
+            def update_progress(done, total, symbol):
+                progress_bar.progress(int((done / total) * 100))
+                status_placeholder.markdown(f"<p style='color: #555;'>已完成 {symbol}... ({done}/{total})</p>", unsafe_allow_html=True)
             
-            with st.spinner(f"正在分析 {symbol}..."):
-                # 分析股票代碼格式
-                formatted_symbol, market_type = analyze_symbol(symbol)
-                if formatted_symbol != symbol:
-                    st.info(f"原始代碼 {symbol} {market_type}")
-                    symbol = formatted_symbol
-                
-                # 獲取股票數據
-                df = get_stock_data(symbol, period)
+            status_placeholder.markdown(f"<p style='color: #555;'>正在並行分析 {len(symbols)} 支股票...</p>", unsafe_allow_html=True)
+            loaded = load_stocks_parallel(symbols, period, int(max_workers), on_progress=update_progress)
+        else:
+            for idx, symbol in enumerate(symbols):
+                # 更新進度
+                progress = int((idx / len(symbols)) * 100)
+                progress_bar.progress(progress)
+                status_placeholder.markdown(f"<p style='color: #555;'>正在分析 {symbol}... ({idx+1}/{len(symbols)})</p>", unsafe_allow_html=True)
                 
-                # 檢查數據有效性
-                if df is not None and not df.empty and len(df) >= 5:
-                    # 計算指標
-                    try:
-                        # 獲取最新收盤價 - 修正
-                        latest_close = df['Close'].iloc[-1].item() if hasattr(df['Close'].iloc[-1], 'item') else float(df['Close'].iloc[-1])
-                        
-                        # 計算RSI
-                        rsi = calculate_rsi(df)
-                        latest_rsi = rsi.iloc[-1].item() if hasattr(rsi.iloc[-1], 'item') else float(rsi.iloc[-1])
-                        
-                        # 生成訊號
-                        if latest_rsi < 30:
-                            rsi_signal = "買入"
-                        elif latest_rsi > 70:
-                            rsi_signal = "賣出"
-                        else:
-                            rsi_signal = "觀望"
-                            
-                        # 預測價格
-                        future_dates, future_prices, price_change = predict_future_prices(df, days=5)
-                        
-                        # 預測訊號 - 確保price_change是標量
-                        if isinstance(price_change, (list, np.ndarray)):
-                            if len(price_change) > 0:
-                                price_change = float(price_change[0])
-                            else:
-                                price_change = 0.0
-                                
-                        if price_change > 3:
-                            pred_signal = "買入"
-                        elif price_change < -3:
-                            pred_signal = "賣出"
-                        else:
-                            pred_signal = "觀望"
-                            
-                        # 合併訊號
-                        if rsi_signal == "買入" and pred_signal == "買入":
-                            overall_signal = "強烈買入"
-                        elif rsi_signal == "賣出" and pred_signal == "賣出":
-                            overall_signal = "強烈賣出"
-                        elif rsi_signal == "買入" or pred_signal == "買入":
-                            overall_signal = "買入"
-                        elif rsi_signal == "賣出" or pred_signal == "賣出":
-                            overall_signal = "賣出"
-                        else:
-                            overall_signal = "觀望"
-                            
-                        # 添加到結果
-                        results.append({
-                            "代碼": symbol,
-                            "收盤價": f"${latest_close:.2f}",
-                            "RSI": f"{latest_rsi:.1f}",
-                            "預測變動": f"{price_change:.2f}%",
-                            "RSI信號": rsi_signal,
-                            "預測信號": pred_signal,
-                            "整體建議": overall_signal,
-                            "raw_price_change": price_change  # 用於排序
-                        })
-                    except Exception as e:
-                        st.error(f"分析 {symbol} 過程中出錯: {str(e)}")
-                else:
-                    st.error(f"{symbol} 無法獲取數據，請確認代碼正確")
+                with st.spinner(f"正在分析 {symbol}..."):
+                    loaded.append(load_stock(symbol, period))
+        
+        # 按提交順序收集數據，並以面板方式一次計算所有股票的指標
+        frames = dict(item for item in loaded if item is not None)
+        analyses = score_stocks(frames, rsi_window=rsi_window, oversold=oversold_threshold, overbought=overbought_threshold)
+        results = [analysis["row"] for analysis in analyses]
+        
+        # 蒙地卡羅預測區間，所有股票一次模擬
+        mc_bands = {}
+        forecastable = [analysis for analysis in analyses if analysis["future_prices"]]
+        if show_mc and forecastable:
+            bands = monte_carlo_bands(
+                [analysis["df"]['Close'].to_numpy(dtype=np.float64) for analysis in forecastable],
+                [analysis["future_prices"] for analysis in forecastable],
+                n_paths=int(mc_paths)
+            )
+            for analysis, band in zip(forecastable, bands):
+                mc_bands[analysis["symbol"]] = band
+                analysis["row"]["預測區間"] = f"${band[0, -1]:.2f} - ${band[-1, -1]:.2f}"
+        
+        # 單一股票時保留詳細分析所需的數據
+        df = None
+        if analyses:
+            symbol = analyses[-1]["symbol"]
+            df = analyses[-1]["df"]
+            latest_rsi = analyses[-1]["latest_rsi"]
+            price_change = analyses[-1]["price_change"]
+            future_dates = analyses[-1]["future_dates"]
+            future_prices = analyses[-1]["future_prices"]
         
         # 分析完成
         progress_bar.progress(100)
@@ -1084,6 +3268,13 @@ if search_button:
             for result in results:
                 if "raw_price_change" in result:
                     del result["raw_price_change"]
+            
+            # 加入基本信息，未能及時載入的顯示 N/A
+            stock_infos = collect_stock_infos(stock_info_futures)
+            for result in results:
+                info = stock_infos.get(result["代碼"])
+                result["市值"] = format_market_cap(info["市值"]) if info else "N/A"
+                result["本益比"] = format_pe_ratio(info["本益比"]) if info else "N/A"
                     
             results_df = pd.DataFrame(results)
             
@@ -1097,7 +3288,10 @@ if search_button:
                     "預測變動": st.column_config.TextColumn("5日預測變動"),
                     "RSI信號": st.column_config.TextColumn("RSI信號"),
                     "預測信號": st.column_config.TextColumn("預測信號"),
-                    "整體建議": st.column_config.TextColumn("整體建議")
+                    "整體建議": st.column_config.TextColumn("整體建議"),
+                    "市值": st.column_config.TextColumn("市值"),
+                    "本益比": st.column_config.TextColumn("本益比"),
+                    "預測區間": st.column_config.TextColumn("5日預測區間 (5%-95%)")
                 },
                 use_container_width=True,
                 hide_index=True
@@ -1127,6 +3321,41 @@ if search_button:
                 # 顯示比較結果
                 display_comparison_results(best_stock, best_change, worst_stock, worst_change, avg_performance)
             
+            # 歷史訊號回測
+            if show_backtest and frames:
+                st.subheader("歷史訊號回測")
+                backtest_df = backtest_signals(build_close_panel(frames), rsi_window=rsi_window,
+                                               oversold=oversold_threshold, overbought=overbought_threshold)
+                st.dataframe(
+                    backtest_df,
+                    column_config={
+                        column: st.column_config.NumberColumn(column, format="%.1f")
+                        for column in ["命中率", "平均收益(%)", "策略收益(%)", "最大回撤(%)", "買入持有(%)"]
+                    },
+                    use_container_width=True,
+                    hide_index=True
+                )
+                st.caption("訊號在當日收盤產生；命中率與平均收益以其後5個交易日的收益計算，策略收益為買入後持有、賣出後空倉")
+            
+            # RSI 參數掃描
+            if run_sweep and frames:
+                st.subheader("RSI參數掃描")
+                with st.spinner("正在回測參數組合..."):
+                    sweep_df = run_parameter_sweep(frames)
+                st.dataframe(
+                    sweep_df,
+                    column_config={
+                        column: st.column_config.NumberColumn(column, format="%.1f")
+                        for column in ["命中率", "平均收益(%)", "策略收益(%)", "最大回撤(%)"]
+                    },
+                    use_container_width=True,
+                    hide_index=True
+                )
+                current = sweep_df[(sweep_df["RSI週期"] == rsi_window) & (sweep_df["超賣閾值"] == oversold_threshold)
+                                   & (sweep_df["超買閾值"] == overbought_threshold)] if not sweep_df.empty else sweep_df
+                if not current.empty:
+                    st.caption(f"目前設置 RSI({rsi_window}) {oversold_threshold}/{overbought_threshold} 排名第 {int(current['排名'].iloc[0])} / {len(sweep_df)}")
+            
             # 添加單個股票的詳細分析部分
             if len(symbols) == 1 and df is not None:
                 st.subheader(f"{symbols[0]} 詳細分析")
@@ -1143,12 +3372,34 @@ if search_button:
                 with col2:
                     # RSI值
                     rsi_value = latest_rsi
-                    st.metric("RSI(14)", f"{rsi_value:.1f}", None)
+                    st.metric(f"RSI({rsi_window})", f"{rsi_value:.1f}", None)
                 
                 with col3:
                     # 預測
                     st.metric("5日預測變動", f"{price_change:.2f}%", None)
                 
+                # 基本面信息
+                stock_info = stock_infos.get(symbol)
+                if stock_info:
+                    col1, col2, col3 = st.columns(3)
+                    
+                    with col1:
+                        st.metric("市值", format_market_cap(stock_info["市值"]), None)
+                        st.caption(f"{stock_info['公司名稱']} | {stock_info['行業']}")
+                    
+                    with col2:
+                        st.metric("本益比", format_pe_ratio(stock_info["本益比"]), None)
+                    
+                    with col3:
+                        low, high = stock_info["52週低點"], stock_info["52週高點"]
+                        st.metric("52週範圍", f"${low:.2f} - ${high:.2f}" if is_number(low) and is_number(high) else "N/A", None)
+                
+                # 圖表需要的均線與RSI一次計算
+                chart_specs = [("MA", period) for period in ma_periods or []]
+                if show_rsi:
+                    chart_specs += [("RSI", rsi_window), ("RSI_WILDER", rsi_window)]
+                chart_indicators = compute_indicators(df, chart_specs, symbol=symbol)
+                
                 # 绘制股价图表
                 st.subheader("股價趨勢")
                 fig = go.Figure()
@@ -1165,11 +3416,9 @@ if search_button:
                 if ma_periods:
                     for period in ma_periods:
                         ma_col = f'MA_{period}'
-                        if ma_col not in df.columns:
-                            df[ma_col] = df['Close'].rolling(window=period).mean()
                         fig.add_trace(go.Scatter(
                             x=df.index, 
-                            y=df[ma_col], 
+                            y=chart_indicators[ma_col], 
                             name=f"{period}日均線",
                             line=dict(width=1.5)
                         ))
@@ -1185,6 +3434,34 @@ if search_button:
                         marker=dict(size=6, color='orange')
                     ))
                 
+                # 蒙地卡羅預測區間（扇形）
+                if future_dates and symbol in mc_bands:
+                    band = mc_bands[symbol]
+                    fig.add_trace(go.Scatter(
+                        x=future_dates,
+                        y=band[-1],
+                        mode='lines',
+                        line=dict(width=0),
+                        showlegend=False,
+                        hoverinfo='skip'
+                    ))
+                    fig.add_trace(go.Scatter(
+                        x=future_dates,
+                        y=band[0],
+                        mode='lines',
+                        line=dict(width=0),
+                        fill='tonexty',
+                        fillcolor='rgba(255, 165, 0, 0.2)',
+                        name=f'預測區間 ({MC_PERCENTILES[0]}%-{MC_PERCENTILES[-1]}%)'
+                    ))
+                    fig.add_trace(go.Scatter(
+                        x=future_dates,
+                        y=band[1],
+                        mode='lines',
+                        name='模擬中位數',
+                        line=dict(color='rgba(255, 140, 0, 0.6)', width=1)
+                    ))
+                
                 # 更新布局
                 fig.update_layout(
                     title=f"{symbols[0]} 股價走勢",
@@ -1235,7 +3512,7 @@ if search_button:
                     st.markdown(f"""
                     <div style="background-color: #f0f7ff; padding: 15px; border-radius: 8px; margin: 15px 0; border-left: 3px solid #1976D2;">
                         <span style="color: #1976D2; font-weight: 600;">預測方法:</span> 
-                        <span style="color: #555;">基於線性迴歸與機器學習模型的綜合預測，考慮歷史趨勢與市場因素。未來5日內最大預測漲幅為 
+                        <span style="color: #555;">以線性趨勢與 Holt 指數平滑兩種模型的加權組合預測，兩者均只依據歷史收盤價。未來5日內最大預測漲幅為 
                         <span style="color: {('#4CAF50' if price_change > 0 else '#F44336')}; font-weight: 600;">{price_change:.2f}%</span></span>
                     </div>
                     """, unsafe_allow_html=True)
@@ -1247,7 +3524,7 @@ if search_button:
                     volume_fig = px.bar(
                         df,
                         x=df.index,
-                        y=('Volume', symbol),  # Use tuple for multi-index column
+                        y='Volume',
                         title='交易量',
                         labels={'x': '日期', 'y': '交易量'},
                         color_discrete_sequence=['#1976D2']
@@ -1265,7 +3542,7 @@ if search_button:
                 # 如果有RSI指标
                 if show_rsi:
                     st.subheader("RSI指標")
-                    rsi = compute_rsi(df, window=rsi_window)
+                    rsi = chart_indicators['RSI']
                     
                     rsi_fig = go.Figure()
                     rsi_fig.add_trace(go.Scatter(
@@ -1273,6 +3550,12 @@ if search_button:
                         y=rsi,
                         name=f"RSI({rsi_window})"
                     ))
+                    rsi_fig.add_trace(go.Scatter(
+                        x=df.index,
+                        y=chart_indicators['RSI_Wilder'],
+                        name=f"Wilder RSI({rsi_window})",
+                        line=dict(width=1, dash='dot')
+                    ))
                     
                     # 添加超買超賣線
                     rsi_fig.add_hline(y=overbought_threshold, line_width=1, line_dash="dash", line_color="red")
@@ -0,0 +1,18 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(scope="session")
+def app(tmp_path_factory):
+    """以 Streamlit 的無伺服器模式載入 app_simple，停用背景預熱並使用臨時數據庫"""
+    tmp = tmp_path_factory.mktemp("stock")
+    os.environ["STOCK_WARM_CACHE"] = "0"
+    os.environ["STOCK_HISTORY_DB"] = str(tmp / "ohlcv.db")
+    os.environ["STOCK_FIXTURE_DIR"] = str(tmp / "fixtures")
+    return importlib.import_module("app_simple")
@@ -0,0 +1,64 @@
+import pandas as pd
+import pytest
+
+
+@pytest.fixture
+def breaker(app, monkeypatch):
+    """每個測試使用自己的熔斷狀態（舊版 Streamlit 在無伺服器模式下不會快取 cache_resource）"""
+    registry = app.get_provider_health()
+    monkeypatch.setattr(app, "get_provider_health", lambda: registry)
+    return registry["providers"]
+
+
+def test_empty_single_symbol_download_is_inconclusive(app, breaker, monkeypatch):
+    monkeypatch.setattr(app, "yahoo_download", lambda *args, **kwargs: pd.DataFrame())
+    today = pd.Timestamp.now().normalize()
+    # 無效代碼同樣返回空的結果，不應暫停數據源
+    for _ in range(app.CIRCUIT_FAILURE_THRESHOLD):
+        assert app.fetch_yahoo_range("NOSUCH", today - pd.Timedelta(days=30), today) is None
+    assert breaker["yahoo"]["state"] == "closed"
+    # 試探請求得到空的結果時重新暫停
+    breaker["yahoo"].update(state="open", opened_at=0.0)
+    assert app.fetch_yahoo_range("NOSUCH", today - pd.Timedelta(days=30), today) is None
+    assert breaker["yahoo"]["state"] == "open"
+
+
+def test_yahoo_exceptions_count_as_failures(app, breaker, monkeypatch):
+    def fail(*args, **kwargs):
+        raise ConnectionError("reset")
+    monkeypatch.setattr(app, "yahoo_download", fail)
+    today = pd.Timestamp.now().normalize()
+    for _ in range(app.CIRCUIT_FAILURE_THRESHOLD):
+        with pytest.raises(ConnectionError):
+            app.fetch_yahoo_range("AAPL", today - pd.Timedelta(days=30), today)
+    assert breaker["yahoo"]["state"] == "open"
+    assert not app.provider_available("yahoo")
+
+
+def test_empty_batch_download_counts_as_failure(app, breaker, monkeypatch):
+    monkeypatch.setattr(app, "yahoo_download", lambda *args, **kwargs: pd.DataFrame())
+    errors = []
+    assert app.get_yahoo_batch_data(["AAPL", "MSFT"], chunk_size=1, on_error=errors.append) == {}
+    assert breaker["yahoo"]["failures"] == 2
+    assert errors
+
+
+def test_inconclusive_probe_reopens_breaker(app, breaker):
+    breaker["finnhub"].update(state="open", opened_at=0.0)
+    assert app.provider_available("finnhub")
+    assert breaker["finnhub"]["state"] == "half_open"
+    app.record_provider_inconclusive("finnhub", "no_data")
+    assert breaker["finnhub"]["state"] == "open"
+
+
+def test_inconclusive_request_does_not_trip_closed_breaker(app, breaker):
+    for _ in range(app.CIRCUIT_FAILURE_THRESHOLD):
+        app.record_provider_inconclusive("finnhub", "no_data")
+    assert breaker["finnhub"]["state"] == "closed"
+
+
+def test_lost_probe_is_treated_as_failure(app, breaker):
+    breaker["alphavantage"].update(state="half_open", probe_at=0.0)
+    assert not app.provider_available("alphavantage")
+    assert breaker["alphavantage"]["state"] == "open"
+    assert breaker["alphavantage"]["failures"] == 1
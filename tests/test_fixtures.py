@@ -0,0 +1,26 @@
+import numpy as np
+import pandas as pd
+
+
+def make_frame(dates, start=100.0):
+    close = np.linspace(start, start + 10, len(dates))
+    return pd.DataFrame({
+        'Open': close, 'High': close * 1.01, 'Low': close * 0.99, 'Close': close,
+        'Volume': np.full(len(dates), 1000, dtype=np.int64),
+    }, index=pd.DatetimeIndex(dates, name='Date'))
+
+
+def test_recorded_fixture_round_trips_and_merges(app):
+    dates = pd.bdate_range("2024-01-02", periods=40)
+    first, second = make_frame(dates[:30]), make_frame(dates[20:], start=200.0)
+    app.record_fixture("BRK.B", first)
+    app.record_fixture("BRK.B", second)
+
+    assert app.get_fixture_path("BRK.B").endswith(".parquet")
+    stored = app.load_fixture("BRK.B")
+    expected = pd.concat([first.iloc[:20], second])
+    pd.testing.assert_frame_equal(stored, expected, check_freq=False)
+
+
+def test_missing_fixture_is_none(app):
+    assert app.load_fixture("NOPE") is None
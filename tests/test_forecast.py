@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+
+def make_frames():
+    rng = np.random.default_rng(7)
+    frames = {}
+    for symbol, periods in (("AAA", 60), ("BBB", 150)):
+        dates = pd.bdate_range("2024-01-02", periods=periods)
+        close = 100 * np.exp(np.cumsum(rng.normal(0.001, 0.02, periods)))
+        frames[symbol] = pd.DataFrame({
+            'Open': close, 'High': close, 'Low': close, 'Close': close, 'Volume': 1000,
+        }, index=pd.DatetimeIndex(dates, name='Date'))
+    return frames
+
+
+@pytest.mark.parametrize("source", ["Yahoo Finance (15分鐘延遲)", "Alpha Vantage API (實時)", "混合模式 (推薦)"])
+def test_backtest_prediction_matches_live_forecast(app, monkeypatch, source):
+    monkeypatch.setattr(app, "data_source", source)
+    frames = make_frames()
+    closes = app.build_close_panel(frames)
+    compact, _ = app.compact_columns(closes.to_numpy(dtype=np.float64))
+    change = app.expanding_forecast_change(compact, days=5)
+    for j, (symbol, df) in enumerate(frames.items()):
+        _, prices, live_change = app.predict_future_prices(df, days=5)
+        # 回測在該股票最後一個交易日的預測與分析結果相同
+        np.testing.assert_allclose(change[len(df) - 1, j], live_change, rtol=1e-9)
+        # 回測在較早的交易日只使用當時已有的數據
+        early = app.predict_future_prices(df.iloc[:40], days=5)[2]
+        np.testing.assert_allclose(change[39, j], early, rtol=1e-9)
+
+
+def test_batch_forecast_matches_single_forecast(app, monkeypatch):
+    monkeypatch.setattr(app, "data_source", "混合模式 (推薦)")
+    frames = make_frames()
+    batch = app.predict_future_prices_batch(frames, days=5)
+    for symbol, df in frames.items():
+        np.testing.assert_allclose(batch[symbol][1], app.predict_future_prices(df, days=5)[1], rtol=1e-9)
@@ -0,0 +1,27 @@
+def test_failed_lookup_returns_none(app, monkeypatch):
+    def fail(symbol):
+        raise ValueError("no data")
+    monkeypatch.setattr(app, "fetch_stock_info", fail)
+    assert app.get_stock_info("AAPL") is None
+
+
+def test_formatting_ignores_non_numeric_values(app):
+    assert app.format_pe_ratio(None) == "N/A"
+    assert app.format_pe_ratio("Infinity") == "N/A"
+    assert app.format_pe_ratio(float("inf")) == "N/A"
+    assert app.format_pe_ratio(-3.0) == "N/A"
+    assert app.format_pe_ratio(21.456) == "21.5"
+    assert app.format_market_cap(None) == "N/A"
+    assert app.format_market_cap("3T") == "N/A"
+    assert app.format_market_cap(2.5e12) == "$2.50T"
+
+
+def test_slow_lookups_share_one_deadline(app):
+    from concurrent.futures import Future
+    ready, failed = Future(), Future()
+    ready.set_result({"市值": 1e12, "本益比": 20.0})
+    failed.set_exception(ValueError("no data"))
+    futures = {"AAPL": ready, "MSFT": failed, "SLOW1": Future(), "SLOW2": Future(), "SLOW3": Future()}
+    start = app.time.monotonic()
+    assert app.collect_stock_infos(futures, timeout=0.2) == {"AAPL": {"市值": 1e12, "本益比": 20.0}}
+    assert app.time.monotonic() - start < 0.5
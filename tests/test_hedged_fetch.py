@@ -0,0 +1,81 @@
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+
+def make_frame():
+    dates = pd.bdate_range("2024-01-02", periods=30)
+    close = np.linspace(100, 110, len(dates))
+    return pd.DataFrame({'Open': close, 'High': close, 'Low': close, 'Close': close, 'Volume': 1000}, index=dates)
+
+
+@pytest.fixture
+def limiters(app, monkeypatch):
+    """測試與被測代碼使用同一組令牌桶（舊版 Streamlit 在無伺服器模式下不會快取 cache_resource）"""
+    limiters = app.get_rate_limiters()
+    monkeypatch.setattr(app, "get_rate_limiters", lambda: limiters)
+    return limiters
+
+
+def test_losing_leg_does_not_consume_quota(app, limiters):
+    bucket = limiters["buckets"]["alphavantage"]
+    with limiters["lock"]:
+        # 令牌不足，備援請求需排隊約 2 秒
+        bucket.update(tokens=1 - 2 * bucket["rate"], updated=time.monotonic())
+        day_count = bucket["day_count"]
+    finished = threading.Event()
+    outcome = {}
+
+    def primary():
+        time.sleep(0.3)
+        return make_frame()
+
+    def hedge():
+        try:
+            app.acquire_rate_limit("alphavantage")
+            outcome["sent"] = True
+        except app.RequestCancelled:
+            outcome["cancelled"] = True
+        finally:
+            finished.set()
+
+    source, df = app.fetch_hedged([("Yahoo Finance", primary), ("Alpha Vantage", hedge)], hedge_delay=0.05)
+    assert source == "Yahoo Finance" and df is not None
+    assert finished.wait(5)
+    assert outcome == {"cancelled": True}
+    with limiters["lock"]:
+        assert bucket["day_count"] == day_count
+
+
+def test_cancelled_leg_sends_no_request(app, monkeypatch):
+    sent = []
+    monkeypatch.setattr(app, "get_http_session", lambda provider: type("S", (), {"get": lambda self, url, **kw: sent.append(url)})())
+    event = threading.Event()
+    event.set()
+    app.request_context.cancel_event = event
+    try:
+        try:
+            app.http_get("alphavantage", "https://example.invalid")
+        except app.RequestCancelled:
+            pass
+    finally:
+        app.request_context.cancel_event = None
+    assert sent == []
+
+
+def test_quiet_fetch_shows_no_messages(app, monkeypatch):
+    shown = []
+    monkeypatch.setattr(app.st, "success", lambda *args, **kwargs: shown.append(args))
+
+    def fetch():
+        app.notify.success("成功")
+        return make_frame()
+
+    monkeypatch.setattr(app, "fetch_stock_data", lambda symbol, period_str: app.fetch_hedged([("Yahoo Finance", fetch)])[1])
+    assert app.get_stock_data("TEST", "6mo", quiet=True) is not None
+    assert shown == []
+    assert app.get_stock_data("TEST", "6mo") is not None
+    assert len(shown) == 1
@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+
+def make_frame(provider):
+    dates = pd.bdate_range("2024-01-02", periods=60)
+    close = 100 + np.sin(np.arange(len(dates)) / 3) * 5
+    df = pd.DataFrame({'Open': close, 'High': close, 'Low': close, 'Close': close, 'Volume': 1000},
+                      index=pd.DatetimeIndex(dates, name='Date'))
+    df.attrs["history_provider"] = provider
+    return df
+
+
+@pytest.fixture
+def indicator_cache(app, monkeypatch):
+    """存取使用同一個快取（舊版 Streamlit 在無伺服器模式下不會快取 cache_resource）"""
+    cache = app.get_indicator_cache()
+    monkeypatch.setattr(app, "get_indicator_cache", lambda: cache)
+    return cache
+
+
+def test_fingerprint_tracks_provider_and_revised_bars(app, indicator_cache):
+    df = make_frame("yahoo")
+    app.store_indicator("FPTEST", df, "RSI", (14,), app.compute_rsi(df, 14))
+
+    assert app.lookup_indicator("FPTEST", make_frame("yahoo"), "RSI", (14,)) is not None
+    # 同一份數據來自另一個數據源
+    assert app.lookup_indicator("FPTEST", make_frame("alphavantage"), "RSI", (14,)) is None
+    # 較早的K線被修正，最後一根K線與長度不變
+    revised = make_frame("yahoo")
+    revised.iloc[10, revised.columns.get_loc('Close')] += 1.0
+    assert app.lookup_indicator("FPTEST", revised, "RSI", (14,)) is None
+
+
+def test_normalize_keeps_provider(app):
+    df = make_frame("finnhub")
+    df['Volume'] = df['Volume'].astype(float)
+    assert app.normalize_ohlcv(df).attrs["history_provider"] == "finnhub"
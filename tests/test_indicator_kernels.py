@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+def kernel_variants(kernel):
+    """純 Python 的遞推核心，以及安裝了 Numba 時編譯後的版本"""
+    variants = [kernel]
+    if numba is not None:
+        variants.append(numba.njit(error_model='numpy')(kernel))
+    return variants
+
+
+@pytest.fixture
+def numpy_backend(app, monkeypatch):
+    """讓 ema_2d / wilder_rsi_values 走 STOCK_INDICATOR_BACKEND=numpy 的實現"""
+    monkeypatch.setattr(app, "get_jit_kernels", lambda: None)
+    return app
+
+
+def random_panel(seed, rows=300, cols=6):
+    rng = np.random.default_rng(seed)
+    values = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, (rows, cols)), axis=0))
+    # 前段缺失（較晚上市）與隨機缺失
+    values[:rng.integers(1, 40), 0] = np.nan
+    values[rng.random((rows, cols)) < 0.1] = np.nan
+    values[:, -1] = np.nan
+    return values
+
+
+def random_closes(seed, n=300):
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, n)))
+    # 加入沒有變動（gain 與 loss 同為 0）和只上漲（loss 為 0）的區段，長度按 n 縮放
+    flat, rising, span = n // 3, 2 * n // 3, max(n // 10, 1)
+    close[flat:flat + span] = close[flat - 1]
+    close[rising:rising + span] = close[rising - 1] * np.linspace(1.0, 1.2, span)
+    return close
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_ema_loop_matches_numpy_backend(numpy_backend, seed):
+    app = numpy_backend
+    values = random_panel(seed)
+    for span in (5, 12, 26):
+        expected = app.ema_2d(values, span)
+        for kernel in kernel_variants(app.ema_loop):
+            np.testing.assert_allclose(kernel(values, 2.0 / (span + 1)), expected, rtol=1e-12, equal_nan=True)
+
+
+def test_ema_numpy_backend_matches_pandas(numpy_backend):
+    app = numpy_backend
+    values = random_panel(3)
+    expected = pd.DataFrame(values).ewm(span=12, adjust=False, ignore_na=True).mean().ffill().to_numpy()
+    np.testing.assert_allclose(app.ema_2d(values, 12), expected, rtol=1e-10, equal_nan=True)
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+@pytest.mark.parametrize("window", [2, 14, 30])
+def test_wilder_rsi_loop_matches_numpy_backend(numpy_backend, seed, window):
+    app = numpy_backend
+    close = random_closes(seed)
+    expected = app.wilder_rsi_values(close, window)
+    for kernel in kernel_variants(app.wilder_rsi_loop):
+        np.testing.assert_allclose(kernel(close, window), expected, rtol=1e-10, equal_nan=True)
+
+
+def test_wilder_rsi_short_series_is_nan(numpy_backend):
+    app = numpy_backend
+    close = random_closes(4, n=10)
+    assert np.isnan(app.wilder_rsi_values(close, 14)).all()
+    assert np.isnan(app.wilder_rsi_loop(close, 14)).all()
+
+
+def test_wilder_rsi_spec_on_frame_with_gaps(numpy_backend):
+    app = numpy_backend
+    dates = pd.bdate_range("2024-01-02", periods=300)
+    close = pd.Series(random_closes(5), index=dates)
+    # normalize_ohlcv 會移除沒有收盤價的行，指標只在有效的K線上遞推
+    close.iloc[np.random.default_rng(5).random(len(close)) < 0.1] = np.nan
+    df = app.normalize_ohlcv(pd.DataFrame({
+        'Open': close, 'High': close, 'Low': close, 'Close': close, 'Volume': 1000,
+    }))
+    result = app.compute_indicators(df, [("RSI_WILDER", 14)])['RSI_Wilder'].to_numpy()
+    np.testing.assert_allclose(result, app.wilder_rsi_loop(df['Close'].to_numpy(dtype=np.float64), 14), rtol=1e-10, equal_nan=True)
+
+
+def test_wilder_rsi_backends_agree_on_missing_values(numpy_backend):
+    app = numpy_backend
+    close = random_closes(6)
+    close[np.random.default_rng(6).random(len(close)) < 0.1] = np.nan
+    valid = ~np.isnan(close)
+    expected = np.full(len(close), np.nan)
+    expected[valid] = app.wilder_rsi_loop(close[valid], 14)
+    np.testing.assert_allclose(app.wilder_rsi_values(close, 14), expected, rtol=1e-10, equal_nan=True)
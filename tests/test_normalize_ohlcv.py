@@ -0,0 +1,16 @@
+import numpy as np
+import pandas as pd
+
+
+def test_canonical_frame_with_missing_close_is_cleaned(app):
+    dates = pd.bdate_range("2024-01-02", periods=10)
+    close = np.linspace(100, 109, len(dates)).astype(app.OHLC_DTYPE)
+    close[[2, 5]] = np.nan
+    df = pd.DataFrame({'Open': close, 'High': close, 'Low': close, 'Close': close}, index=dates)
+    df['Volume'] = np.int64(1000)
+
+    out = app.normalize_ohlcv(df)
+    assert len(out) == 8
+    assert not out['Close'].isna().any()
+    # 清理後的數據已是統一格式，再次轉換不會複製
+    assert app.normalize_ohlcv(out) is out
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+
+
+def make_frame(dates, seed):
+    rng = np.random.default_rng(seed)
+    close = 100 + np.cumsum(rng.normal(0, 1, len(dates)))
+    return pd.DataFrame(
+        {"Open": close, "High": close, "Low": close, "Close": close, "Volume": np.zeros(len(dates), dtype=np.int64)},
+        index=pd.DatetimeIndex(dates, name="Date"),
+    )
+
+
+def two_calendars():
+    us_dates = pd.bdate_range("2024-01-01", periods=120)
+    # 台股有美股休市時的交易日，也缺少部分美股交易日
+    tw_dates = us_dates.delete([5, 17, 40, 41]).union(pd.DatetimeIndex(["2024-01-06", "2024-02-10", "2024-03-16"]))
+    return {"AAPL": make_frame(us_dates, 1), "2330.TW": make_frame(tw_dates, 2)}
+
+
+def test_panel_indicators_match_per_symbol_on_different_calendars(app):
+    frames = two_calendars()
+    indicators = app.compute_panel_indicators(app.build_close_panel(frames))
+    for symbol, df in frames.items():
+        close = df["Close"]
+        expected = {
+            "RSI": app.compute_rsi(df, window=14),
+            "MA_20": close.rolling(20).mean(),
+            "MA_50": close.rolling(50).mean(),
+            "BB_upper": close.rolling(20).mean() + 2 * close.rolling(20).std(),
+            "MACD": close.ewm(span=12, adjust=False).mean() - close.ewm(span=26, adjust=False).mean(),
+        }
+        for name, values in expected.items():
+            got = indicators[name][symbol].reindex(df.index)
+            np.testing.assert_allclose(got.to_numpy(), values.to_numpy(), rtol=1e-9, atol=1e-9, equal_nan=True)
+        # 該股票沒有交易的日期不產生指標值
+        missing = indicators["RSI"].index.difference(df.index)
+        assert indicators["RSI"].loc[missing, symbol].isna().all()
+
+
+def test_latest_panel_rsi_is_valid_for_gapped_symbols(app):
+    frames = two_calendars()
+    closes = app.build_close_panel(frames)
+    latest = app.latest_panel_values(app.compute_panel_indicators(closes)["RSI"], closes)
+    for symbol, df in frames.items():
+        assert np.isfinite(latest[symbol])
+        np.testing.assert_allclose(latest[symbol], app.compute_rsi(df, window=14).iloc[-1], rtol=1e-9)
+
+
+def test_backtest_uses_each_symbols_own_calendar(app):
+    frames = two_calendars()
+    combined = app.backtest_signals(app.build_close_panel(frames))
+    for symbol, df in frames.items():
+        alone = app.backtest_signals(app.build_close_panel({symbol: df}))
+        pd.testing.assert_frame_equal(
+            combined[combined["代碼"] == symbol].reset_index(drop=True),
+            alone.reset_index(drop=True),
+        )
+
+
+def test_parameter_sweep_matches_single_symbol_sweep(app):
+    frames = two_calendars()
+    args = ((7, 14), (25, 30), (70, 75))
+    combined = app.sweep_rsi_parameters(app.build_close_panel(frames), *args)
+    for symbol, df in frames.items():
+        alone = app.sweep_rsi_parameters(app.build_close_panel({symbol: df}), *args)[symbol]
+        assert len(combined[symbol]) == len(alone) == 2 * 2 * 2
+        for (window, low, high, got), (*params, expected) in zip(combined[symbol], alone):
+            assert (window, low, high) == tuple(params)
+            for name, value in expected.items():
+                np.testing.assert_allclose(got[name], value, rtol=1e-12, equal_nan=True)
+
+    ranked = app.run_parameter_sweep(frames, *args)
+    assert len(ranked) == 8
+    assert (ranked["股票數"] == 2).all()
@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+
+
+def make_frame(dates, seed=0):
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, len(dates))))
+    return pd.DataFrame({
+        'Open': close, 'High': close * 1.01, 'Low': close * 0.99, 'Close': close,
+        'Volume': rng.integers(1000, 5000, len(dates)),
+    }, index=pd.DatetimeIndex(dates, name='Date'))
+
+
+def test_every_save_path_updates_stream_state(app):
+    dates = pd.bdate_range("2024-01-02", periods=120)
+    df = make_frame(dates)
+
+    # 先寫入前段，再以增量方式寫入後段（與批量預取、後台預熱相同的入口）
+    app.save_history("yahoo", "TEST", df.iloc[:80], dates[0])
+    app.save_history("yahoo", "TEST", df.iloc[79:], dates[0])
+
+    values = app.get_stream_indicators("yahoo", "TEST")
+    assert values["Date"] == dates[-1].strftime("%Y-%m-%d")
+    expected = app.compute_rsi(df, window=app.STREAM_PARAMS["rsi_window"]).iloc[-1]
+    np.testing.assert_allclose(values["RSI"], expected, rtol=1e-9)
+    expected_ma = df['Close'].rolling(20).mean().iloc[-1]
+    np.testing.assert_allclose(values["MA_20"], expected_ma, rtol=1e-9)
+
+
+def test_score_stocks_uses_stream_rsi_for_stored_frames(app):
+    dates = pd.bdate_range("2024-01-02", periods=120)
+    df = make_frame(dates, seed=1)
+    app.save_history("yahoo", "STRM", df, dates[0])
+
+    stored = app.load_history("yahoo", "STRM")
+    assert stored.attrs["history_provider"] == "yahoo"
+    assert app.lookup_stream_rsi("STRM", stored, 14) is not None
+    # 狀態只更新到前一天時不使用
+    assert app.lookup_stream_rsi("STRM", stored.iloc[:-1], 14) is None